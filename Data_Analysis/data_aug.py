@@ -1,10 +1,20 @@
 import os
+import sys
+import time
 from pydub import AudioSegment
 from pydub.generators import WhiteNoise
 from pydub.effects import normalize
 import random
-from concurrent.futures import ProcessPoolExecutor
+import argparse
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import manifest
+import sharding
+import pipeline_config
+from pipeline_metrics import StageMetrics
+from pipeline_executor import SharedExecutor, decode_cost
+
+metrics = StageMetrics("augment")
 
 def augment_audio(file_path, output_dir, aug_type, base_name, index):
     """
@@ -17,6 +27,8 @@ def augment_audio(file_path, output_dir, aug_type, base_name, index):
     - aug_type: Type of augmentation (e.g., 'speed', 'noise', 'pitch', 'echo').
     - base_name: Base name of the original file (without extension).
     - index: The index of the augmentation (for uniqueness).
+
+    Returns the path of the augmented file.
     """
     # Load audio
     audio = AudioSegment.from_wav(file_path)
@@ -44,9 +56,10 @@ def augment_audio(file_path, output_dir, aug_type, base_name, index):
     # Save augmented file with the format filename_{aug_type}_{index}.wav
     output_file = os.path.join(output_dir, f"{base_name}_{aug_type}_{index}.wav")
     augmented_audio.export(output_file, format="wav")
+    return output_file
 
 
-def process_directory(subdir, target_count):
+def process_directory(subdir, target_count, gated):
     """
     Augments files in a single directory until the target count is met,
     processing the largest files first, ensuring each file is augmented only once.
@@ -54,9 +67,14 @@ def process_directory(subdir, target_count):
     Args:
     - subdir: The directory to process.
     - target_count: Total number of files required.
+    - gated: Paths in the directory the silence gate rejected; they are not counted or augmented.
+
+    Returns the (source path, output path, augmentation) of every file written
+    and the metrics snapshot of this worker.
     """
-    # Get .wav files in the directory with their file sizes
-    files = [(f, os.path.getsize(os.path.join(subdir, f))) for f in os.listdir(subdir) if f.endswith('.wav')]
+    # Get .wav files in the directory with their file sizes, leaving out clips the silence gate rejected
+    files = [(f, os.path.getsize(os.path.join(subdir, f))) for f in os.listdir(subdir)
+             if f.endswith('.wav') and os.path.join(subdir, f) not in gated]
     
     # Sort files by size in descending order
     files.sort(key=lambda x: x[1], reverse=True)
@@ -64,13 +82,13 @@ def process_directory(subdir, target_count):
     current_count = len(files)
 
     if current_count >= target_count:
-        print(f"Directory '{subdir}' already has {current_count} files. Skipping...")
-        return
+        metrics.incr("directories_skipped")
+        return [], metrics.drain()
 
     files_needed = target_count - current_count
-    print(f"Directory '{subdir}' needs {files_needed} more files. Augmenting...")
 
     augmented_files = set()  # Track which files have been augmented
+    outputs = []
 
     for file, _ in files:
         if files_needed <= 0:
@@ -86,36 +104,181 @@ def process_directory(subdir, target_count):
         # Apply augmentation
         for i in range(files_needed):
             aug_type = random.choice(['speed', 'noise', 'pitch', 'echo'])
-            augment_audio(file_path, subdir, aug_type, base_name, i)
+            start = time.perf_counter()
+            try:
+                output_file = augment_audio(file_path, subdir, aug_type, base_name, i)
+                outputs.append((file_path, output_file, f"{aug_type}_{i}"))
+                metrics.item(time.perf_counter() - start)
+                metrics.incr(aug_type)
+            except Exception as e:
+                # Counted per error type instead of aborting the directory
+                metrics.item(time.perf_counter() - start, ok=False)
+                metrics.incr(f"error_{type(e).__name__}")
         
         augmented_files.add(file)  # Mark this file as augmented
         files_needed -= 1
 
-    print(f"Finished augmenting directory: {subdir}")
+    metrics.incr("directories_augmented")
+    return outputs, metrics.drain()
+
+
+def process_directory_task(task):
+    return process_directory(*task)
+
+
+def directory_cost(task):
+    """Peak memory of augmenting a directory: one decoded file (the largest) at a time."""
+    subdir = task[0]
+    return decode_cost(*[os.path.join(subdir, f) for f in os.listdir(subdir) if f.endswith('.wav')])
+
+
+def collect_subdirectories(main_folders):
+    """
+    (directory, key) for every directory with .wav files; the key is the
+    directory relative to the data root, e.g. 'emergency sounds/Alarm'.
+    """
+    subdirectories = []
+    for main_folder in main_folders:
+        for subdir, _, files in os.walk(main_folder):
+            if any(f.endswith('.wav') for f in files):  # Check for .wav files
+                key = os.path.normpath(os.path.join(os.path.basename(main_folder), os.path.relpath(subdir, main_folder)))
+                subdirectories.append((subdir, key))
+    return subdirectories
+
+
+def augment_directories(subdirectories, target_count, gated, on_outputs, max_workers=None):
+    """
+    Augment the given directories in parallel, aggregating worker metrics as directories finish.
+
+    on_outputs is called in this process with the outputs of each directory
+    that was augmented; workers never open the manifest.
+    """
+    tasks = [(subdir, target_count, {path for path in gated if os.path.dirname(path) == subdir})
+             for subdir in subdirectories]
+    # A task works through a whole directory, so workers are recycled by the WAVs it holds
+    wav_files = [usable_file_count(subdir, subdir_gated) for subdir, _, subdir_gated in tasks]
+    task_weight = max(1, sum(wav_files) / len(wav_files)) if wav_files else 1
+    with SharedExecutor("augment", max_workers=max_workers, task_weight=task_weight) as executor:
+        for outputs, snapshot in executor.map_unordered(process_directory_task, tasks, cost=directory_cost):
+            if outputs:
+                on_outputs(outputs)
+            metrics.merge(snapshot)
+            metrics.report()
+    metrics.report(force=True)
+
+
+def register_outputs(conn, outputs):
+    """Register the augmented files of one directory in the manifest, in one transaction."""
+    main_folders = pipeline_config.main_folders()
+    main_folder, subdirectory = manifest.split_class_path(os.path.dirname(outputs[0][1]), main_folders)
+    manifest.record_augmented(conn, main_folder, subdirectory, outputs)
+
 
+def usable_file_count(subdir, gated):
+    return sum(1 for f in os.listdir(subdir) if f.endswith('.wav') and os.path.join(subdir, f) not in gated)
 
-def process_directories_parallel(main_folders, target_count=1500, max_workers=75):
+
+def process_directories_parallel(main_folders, target_count=1500, max_workers=None):
     """
     Processes all subdirectories in the main folders in parallel, prioritizing large files.
     
     Args:
     - main_folders: List of paths to main folders.
     - target_count: Total number of files required in each directory.
-    - max_workers: Number of parallel processes to use.
+    - max_workers: Upper bound on the number of parallel processes (default: sized from the node).
     """
-    subdirectories = []
+    conn = manifest.connect()
+    subdirectories = [subdir for subdir, _ in collect_subdirectories(main_folders)]
+    augment_directories(subdirectories, target_count, manifest.gated_paths(conn),
+                        lambda outputs: register_outputs(conn, outputs), max_workers)
+    metrics.write_json()
+
+
+def prepare_shards(num_shards):
+    """Snapshot the gate verdicts for the shards; run on the node holding the manifest."""
+    path = sharding.write_inputs("augment", num_shards, {"gated": sorted(manifest.gated_paths(manifest.connect()))})
+    print(f"Prepared {num_shards} augmentation shards in {path}")
+
+
+def run_shard(main_folders, shard, num_shards, target_count=1500, max_workers=None):
+    """
+    Augment one shard of the class directories.
+
+    Directories are the unit of sharding, since the target count is per
+    directory; shards therefore write into disjoint directories of the shared
+    data root, and the shard's record lists the directories, their file counts
+    and the files written, which the merge registers in the manifest. Shards
+    read the gate verdicts from the prepared inputs and never open the manifest.
+
+    Returns False if the run was not prepared.
+    """
+    inputs = sharding.load_inputs("augment", num_shards)
+    if inputs is None:
+        print(f"Shard inputs missing; run --prepare --num-shards {num_shards} first.")
+        return False
+    gated = set(inputs["gated"])
+    subdirectories = [(subdir, key) for subdir, key in collect_subdirectories(main_folders)
+                      if sharding.shard_of(key, num_shards) == shard]
+    written = []
+    augment_directories([subdir for subdir, _ in subdirectories], target_count, gated, written.append, max_workers)
+    sharding.write_record("augment", shard, num_shards, {
+        "keys": sorted(key for _, key in subdirectories),
+        "file_counts": {key: usable_file_count(subdir, gated) for subdir, key in subdirectories},
+        "outputs": written,
+        "metrics": metrics.snapshot(),
+        "started": metrics.started,
+    })
+    print(f"Shard {shard}/{num_shards}: augmented {len(subdirectories)} directories")
+    return True
 
-    # Collect all subdirectories
-    for main_folder in main_folders:
-        for subdir, _, files in os.walk(main_folder):
-            if any(f.endswith('.wav') for f in files):  # Check for .wav files
-                subdirectories.append(subdir)
 
-    # Process subdirectories in parallel
-    with ProcessPoolExecutor(max_workers=max_workers) as executor:
-        executor.map(process_directory, subdirectories, [target_count] * len(subdirectories))
+def merge_shards(main_folders, num_shards, target_count=1500):
+    """Check that every directory was augmented by its shard, register the shards' files and combine their metrics."""
+    subdirectories = collect_subdirectories(main_folders)
+    records, problems = sharding.check_complete("augment", num_shards, [key for _, key in subdirectories])
+    if problems:
+        print(f"Cannot merge {num_shards} augmentation shards:")
+        for problem in problems:
+            print(f"  {problem}")
+        return False
+    conn = manifest.connect()
+    short = {}
+    for record in records:
+        for outputs in record["outputs"]:
+            register_outputs(conn, [tuple(output) for output in outputs])
+        metrics.merge(record["metrics"])
+        # Rates cover the whole sharded run, from the first shard's start
+        metrics.started = min(metrics.started, record["started"])
+        short.update({key: n for key, n in record["file_counts"].items() if n < target_count})
+    metrics.counters["directories_below_target"] = len(short)
+    for key, n in sorted(short.items()):
+        print(f"  {key}: {n}/{target_count} files (not enough source clips)")
+    sharding.clear_stage("augment", num_shards)
+    metrics.report(force=True)
+    metrics.write_json()
+    print(f"Merged {num_shards} shards covering {len(subdirectories)} directories")
+    return True
 
 
 # Main execution
-main_folders = ["../emergency sounds", "../normal sounds"]  # Replace with your main folders
-process_directories_parallel(main_folders, target_count=1500, max_workers=75)
\ No newline at end of file
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Augment class directories, optionally as one shard of a multi-node run.")
+    parser.add_argument("--shard", type=int, help="Index of the shard this process handles.")
+    parser.add_argument("--num-shards", type=int, help="Total number of shards.")
+    parser.add_argument("--prepare", action="store_true", help="Snapshot the manifest state the shards read.")
+    parser.add_argument("--merge", action="store_true", help="Check the finished shards and combine their metrics.")
+    parser.add_argument("--max-workers", type=int, help="Upper bound on worker processes.")
+    args = parser.parse_args()
+    main_folders = pipeline_config.main_folders()
+    target_count = pipeline_config.config["augment_target_count"]
+    if args.shard is not None or args.merge or args.prepare:
+        if not args.num_shards or (args.shard is not None and not 0 <= args.shard < args.num_shards):
+            parser.error("--shard needs --num-shards and 0 <= shard < num-shards; --prepare and --merge need --num-shards.")
+        if args.prepare:
+            prepare_shards(args.num_shards)
+        elif args.merge:
+            sys.exit(0 if merge_shards(main_folders, args.num_shards, target_count) else 1)
+        else:
+            sys.exit(0 if run_shard(main_folders, args.shard, args.num_shards, target_count, args.max_workers) else 1)
+    else:
+        process_directories_parallel(main_folders, target_count=target_count, max_workers=args.max_workers)
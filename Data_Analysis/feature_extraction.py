@@ -1,12 +1,24 @@
 import os
+import sys
+import time
+import argparse
 import librosa
 import numpy as np
 import pandas as pd
 from math import ceil
-from concurrent.futures import ProcessPoolExecutor
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import manifest
+import sharding
+import pipeline_config
+from pipeline_metrics import StageMetrics
+from pipeline_executor import SharedExecutor, decode_cost
+
+metrics = StageMetrics("features")
 
 # Paths to the two main folders
-main_folders = ["../emergency sounds", "../normal sounds"]
+main_folders = pipeline_config.main_folders()
+features_csv = pipeline_config.config["features_csv"]
 
 # Function to extract features from a single audio file
 def extract_features(audio_file, main_folder_name, subdirectory_name):
@@ -16,7 +28,7 @@ def extract_features(audio_file, main_folder_name, subdirectory_name):
 
         # Check if the loaded audio signal is empty
         if y.size == 0:
-            print(f"Warning: {audio_file} is empty or corrupted.")
+            metrics.incr("empty_files")
             return None
 
         # Extract MFCCs
@@ -68,10 +80,10 @@ def extract_features(audio_file, main_folder_name, subdirectory_name):
             'Pitch': pitch,
         }
 
-        print(f"Features extracted for {audio_file}")
         return feature_dict
     except Exception as e:
-        print(f"Error processing {audio_file}: {e}")
+        # Counted per error type instead of printed per file
+        metrics.incr(f"error_{type(e).__name__}")
         return None
 
 # Function to process a chunk of files
@@ -79,10 +91,12 @@ def process_files_chunk(task):
     files, main_folder_name, subdirectory_name = task
     features_list = []
     for audio_file in files:
+        start = time.perf_counter()
         features = extract_features(audio_file, main_folder_name, subdirectory_name)
+        metrics.item(time.perf_counter() - start, ok=features is not None)
         if features:
             features_list.append(features)
-    return features_list
+    return features_list, metrics.drain()
 
 # Function to split files into two chunks for two cores
 def split_files(files, num_chunks=2):
@@ -91,35 +105,193 @@ def split_files(files, num_chunks=2):
     chunk_size = ceil(len(files) / num_chunks)
     return [files[i:i + chunk_size] for i in range(0, len(files), chunk_size)]
 
-# Main function to parallelize processing across directories
-def main():
+# Key identifying the row of a file in the features CSV
+def row_key(main_folder_name, subdirectory_name, file_name):
+    return (main_folder_name, subdirectory_name, file_name)
+
+# Path of a file relative to the data root; what shards are assigned by
+def shard_key(key):
+    return "/".join(key)
+
+# Walk the main folders and pick the files that need (re-)extraction
+def scan_files(gated, extracted, previous_keys, hash_file=None, shard=None, num_shards=1):
+    """
+    Returns (tasks, current_keys, file_hashes, gated_count) for the WAVs not
+    in gated, restricted to one shard's files when shard is given. Without
+    hash_file only current_keys is filled in (no file is hashed).
+    """
     tasks = []
+    current_keys = set()
+    file_hashes = {}
+    gated_count = 0
     for main_folder in main_folders:
         for root, _, files in os.walk(main_folder):
             subdirectory_name = os.path.relpath(root, main_folder)
-            wav_files = [os.path.join(root, file) for file in files if file.endswith(".wav")]
+            wav_files = []
+            for file in files:
+                if not file.endswith(".wav"):
+                    continue
+                audio_file = os.path.join(root, file)
+                if audio_file in gated:
+                    # Rejected by the silence gate; its previous row is dropped too
+                    gated_count += 1
+                    continue
+                key = row_key(os.path.basename(main_folder), subdirectory_name, file)
+                if shard is not None and sharding.shard_of(shard_key(key), num_shards) != shard:
+                    continue
+                current_keys.add(key)
+                if hash_file is None:
+                    continue
+                file_hashes[audio_file] = hash_file(audio_file)
+                if extracted.get(audio_file) != file_hashes[audio_file] or key not in previous_keys:
+                    wav_files.append(audio_file)
             chunks = split_files(wav_files, 2)
             if not chunks:  # Skip if no chunks (empty directory)
                 continue
             for chunk in chunks:
                 tasks.append((chunk, os.path.basename(main_folder), subdirectory_name))
+    return tasks, current_keys, file_hashes, gated_count
 
-    # Parallelize processing using ProcessPoolExecutor
-    with ProcessPoolExecutor() as executor:
-        futures = executor.map(process_files_chunk, tasks)
-
-    # Gather all features
+# Extract features of every task over the shared executor, gathering worker metrics
+def extract_all(tasks, max_workers=None):
+    # A chunk decodes one file at a time, so its memory estimate is that of its largest file
     all_features = []
-    for result in futures:
-        if result:
-            all_features.extend(result)
+    task_weight = sum(len(task[0]) for task in tasks) / len(tasks) if tasks else 1
+    with SharedExecutor("features", max_workers=max_workers, task_weight=task_weight) as executor:
+        for result, snapshot in executor.map_unordered(process_files_chunk, tasks, cost=lambda task: decode_cost(*task[0])):
+            if result:
+                all_features.extend(result)
+            metrics.merge(snapshot)
+            metrics.report()
+    metrics.report(force=True)
+    return all_features
+
+# Previous CSV rows with the rows of re-extracted files replaced and rows of removed files dropped
+def merge_rows(previous, current_keys, all_features):
+    new_keys = {row_key(f['Main_Folder'], f['Subdirectory'], f['File']) for f in all_features}
+    if len(previous):
+        keep = [key in current_keys and key not in new_keys
+                for key in zip(previous['Main_Folder'], previous['Subdirectory'], previous['File'])]
+        previous = previous[keep]
+    return pd.concat([previous, pd.DataFrame(all_features)], ignore_index=True), new_keys
+
+# Files of the tasks whose features were extracted, with their content hashes
+def processed_items(tasks, new_keys, file_hashes):
+    return [(path, file_hashes[path]) for task in tasks for path in task[0]
+            if row_key(task[1], task[2], os.path.basename(path)) in new_keys]
 
-    # Convert the list of features dictionaries to a DataFrame
-    df = pd.DataFrame(all_features)
+def load_previous():
+    previous = pd.read_csv(features_csv) if os.path.exists(features_csv) else pd.DataFrame()
+    previous_keys = set(zip(previous.get('Main_Folder', []), previous.get('Subdirectory', []), previous.get('File', [])))
+    return previous, previous_keys
+
+# Main function to parallelize processing across directories
+def main(max_workers=None):
+    # Only files that are new or changed since their features were extracted are processed
+    conn = manifest.connect()
+    extracted = manifest.stage_item_hashes(conn, "features")
+    previous, previous_keys = load_previous()
+    tasks, current_keys, file_hashes, gated_count = scan_files(
+        manifest.gated_paths(conn), extracted, previous_keys, lambda path: manifest.cached_file_hash(conn, path))
+
+    metrics.total = sum(len(task[0]) for task in tasks)
+    metrics.counters["unchanged_files"] = len(current_keys) - metrics.total
+    metrics.counters["gated_files"] = gated_count
+
+    all_features = extract_all(tasks, max_workers)
+    df, new_keys = merge_rows(previous, current_keys, all_features)
 
     # Save the DataFrame to a CSV file
-    df.to_csv("extracted_features.csv", index=False)
-    print("Feature extraction complete. Saved to extracted_features.csv")
+    df.to_csv(features_csv, index=False)
+    print(f"Feature extraction complete. Saved to {features_csv}")
+
+    # Record processed files so the next run skips them while unchanged
+    manifest.set_stage_items(conn, "features", processed_items(tasks, new_keys, file_hashes))
+    metrics.write_json()
+
+# Before a sharded run, on the manifest's node: snapshot the gate verdicts and hashes the shards need
+def prepare_shards(num_shards):
+    conn = manifest.connect()
+    path = sharding.write_inputs("features", num_shards, {
+        "gated": sorted(manifest.gated_paths(conn)),
+        "extracted": manifest.stage_item_hashes(conn, "features"),
+        "file_hashes": manifest.hash_cache(conn, ".wav"),
+    })
+    print(f"Prepared {num_shards} feature shards in {path}")
+
+# One shard of a sharded run: extract this shard's files into its own partition (never opens the manifest)
+def run_shard(shard, num_shards, max_workers=None):
+    inputs = sharding.load_inputs("features", num_shards)
+    if inputs is None:
+        print(f"Shard inputs missing; run --prepare --num-shards {num_shards} first.")
+        return False
+    _, previous_keys = load_previous()
+    tasks, current_keys, file_hashes, gated_count = scan_files(
+        set(inputs["gated"]), inputs["extracted"], previous_keys,
+        lambda path: manifest.snapshot_file_hash(inputs["file_hashes"], path), shard, num_shards)
+    metrics.total = sum(len(task[0]) for task in tasks)
+    metrics.counters["unchanged_files"] = len(current_keys) - metrics.total
+    metrics.counters["gated_files"] = gated_count
+
+    all_features = extract_all(tasks, max_workers)
+    new_keys = {row_key(f['Main_Folder'], f['Subdirectory'], f['File']) for f in all_features}
+    partition = sharding.partition_path("features", shard, num_shards, ".csv")
+    sharding.write_atomic(partition, lambda tmp: pd.DataFrame(all_features).to_csv(tmp, index=False))
+    sharding.write_record("features", shard, num_shards, {
+        "keys": sorted(shard_key(key) for key in current_keys),
+        "items": processed_items(tasks, new_keys, file_hashes),
+        "metrics": metrics.snapshot(),
+        "started": metrics.started,
+    })
+    print(f"Shard {shard}/{num_shards}: {len(all_features)} files extracted to {partition}")
+    return True
+
+# Combine the shard partitions with the unchanged rows of the previous CSV
+def merge_shards(num_shards):
+    conn = manifest.connect()
+    previous, _ = load_previous()
+    # Every file the shards should have covered
+    _, current_keys, _, _ = scan_files(manifest.gated_paths(conn), {}, set())
+    records, problems = sharding.check_complete("features", num_shards, [shard_key(key) for key in current_keys])
+    if problems:
+        print(f"Cannot merge {num_shards} feature shards:")
+        for problem in problems:
+            print(f"  {problem}")
+        return False
+
+    all_features = []
+    for record in records:
+        partition = sharding.partition_path("features", record["shard"], num_shards, ".csv")
+        if os.path.getsize(partition) > 1:
+            all_features.extend(pd.read_csv(partition).to_dict("records"))
+        metrics.merge(record["metrics"])
+        # Rates cover the whole sharded run, from the first shard's start
+        metrics.started = min(metrics.started, record["started"])
+    df, _ = merge_rows(previous, current_keys, all_features)
+    df.to_csv(features_csv, index=False)
+    manifest.set_stage_items(conn, "features", [tuple(item) for record in records for item in record["items"]])
+    sharding.clear_stage("features", num_shards)
+    metrics.report(force=True)
+    metrics.write_json()
+    print(f"Merged {num_shards} shards ({len(all_features)} extracted files). Saved to {features_csv}")
+    return True
 
 if __name__ == "__main__":
-    main()
+    parser = argparse.ArgumentParser(description="Extract audio features, optionally as one shard of a multi-node run.")
+    parser.add_argument("--shard", type=int, help="Index of the shard this process handles.")
+    parser.add_argument("--num-shards", type=int, help="Total number of shards.")
+    parser.add_argument("--prepare", action="store_true", help="Snapshot the manifest state the shards read.")
+    parser.add_argument("--merge", action="store_true", help="Combine the finished shards into the features CSV.")
+    parser.add_argument("--max-workers", type=int, help="Upper bound on worker processes.")
+    args = parser.parse_args()
+    if args.shard is not None or args.merge or args.prepare:
+        if not args.num_shards or (args.shard is not None and not 0 <= args.shard < args.num_shards):
+            parser.error("--shard needs --num-shards and 0 <= shard < num-shards; --prepare and --merge need --num-shards.")
+        if args.prepare:
+            prepare_shards(args.num_shards)
+        elif args.merge:
+            sys.exit(0 if merge_shards(args.num_shards) else 1)
+        else:
+            sys.exit(0 if run_shard(args.shard, args.num_shards, args.max_workers) else 1)
+    else:
+        main(args.max_workers)
@@ -1,20 +1,30 @@
 import os
+import sys
+import time
 import pandas as pd
 import numpy as np
 import matplotlib.pyplot as plt
 import ast
-from concurrent.futures import ProcessPoolExecutor
 
-# Load the extracted features CSV
-csv_path = "extracted_features.csv"
-df = pd.read_csv(csv_path)
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import pipeline_config
+from pipeline_metrics import StageMetrics
+from pipeline_executor import SharedExecutor
+
+metrics = StageMetrics("plots")
+
+csv_path = pipeline_config.config["features_csv"]
+visualizations_dir = pipeline_config.config["visualizations_dir"]
+
+# Rows plotted per worker task; workers are recycled by rows, not tasks
+ROWS_PER_TASK = 50
 
 # Create directories for saving the plots based on 'Main_Folder' and 'Subdirectory' columns
 def create_save_directories(df):
     save_dirs = {}
     
     for main_folder in df['Main_Folder'].unique():
-        main_folder_path = os.path.join("visualizations", main_folder)
+        main_folder_path = os.path.join(visualizations_dir, main_folder)
         if not os.path.exists(main_folder_path):
             os.makedirs(main_folder_path)
         
@@ -34,12 +44,9 @@ def create_save_directories(df):
     
     return save_dirs
 
-# Get save directories for each combination of Main_Folder and Subdirectory
-save_dirs = create_save_directories(df)
-
 # Visualization functions
 
-def visualize_contrast_chroma(row):
+def visualize_contrast_chroma(row, save_dir):
     # Compute the mean of Spectral Contrast (1 to 7) and Chroma (1 to 12)
     spectral_contrast_mean = [
         row['Spectral_Contrast_1'],
@@ -85,14 +92,11 @@ def visualize_contrast_chroma(row):
     plt.tight_layout()
     
     # Save the plot in the appropriate subdirectory
-    save_path = os.path.join(save_dirs[(row['Main_Folder'], row['Subdirectory'])], "contrast_chroma", f"{row['File']}_contrast_chroma.png")
+    save_path = os.path.join(save_dir, "contrast_chroma", f"{row['File']}_contrast_chroma.png")
     plt.savefig(save_path)
     plt.close()
-    
-    # Print confirmation
-    print(f"Plotted and saved: {row['File']}_contrast_chroma.png")
 
-def visualize_zcr_rms(row):
+def visualize_zcr_rms(row, save_dir):
     zcr = np.array(ast.literal_eval(row["Zero_Crossing_Rate"]))
     rms = np.array(ast.literal_eval(row["RMS"]))
     
@@ -104,14 +108,11 @@ def visualize_zcr_rms(row):
     ax[1].set_title(f'RMS Energy of {row["File"]}')
     
     plt.tight_layout()
-    save_path = os.path.join(save_dirs[(row['Main_Folder'], row['Subdirectory'])], "zcr_rms", f"{row['File']}_zcr_rms.png")
+    save_path = os.path.join(save_dir, "zcr_rms", f"{row['File']}_zcr_rms.png")
     plt.savefig(save_path)
     plt.close()
-    
-    # Print confirmation
-    print(f"Plotted and saved: {row['File']}_zcr_rms.png")
 
-def visualize_centroid_bandwidth(row):
+def visualize_centroid_bandwidth(row, save_dir):
     spectral_centroid = np.array(ast.literal_eval(row["Spectral_Centroid"]))
     spectral_bandwidth = np.array(ast.literal_eval(row["Spectral_Bandwidth"]))
     
@@ -123,14 +124,11 @@ def visualize_centroid_bandwidth(row):
     ax[1].set_title(f'Spectral Bandwidth of {row["File"]}')
     
     plt.tight_layout()
-    save_path = os.path.join(save_dirs[(row['Main_Folder'], row['Subdirectory'])], "centroid_bandwidth", f"{row['File']}_centroid_bandwidth.png")
+    save_path = os.path.join(save_dir, "centroid_bandwidth", f"{row['File']}_centroid_bandwidth.png")
     plt.savefig(save_path)
     plt.close()
-    
-    # Print confirmation
-    print(f"Plotted and saved: {row['File']}_centroid_bandwidth.png")
 
-def visualize_pitch(row):
+def visualize_pitch(row, save_dir):
     pitches = np.array(ast.literal_eval(row["Pitch"]))
     
     fig, ax = plt.subplots(figsize=(12, 6))
@@ -139,21 +137,42 @@ def visualize_pitch(row):
     ax.set_ylabel('Pitch (Hz)')
     
     plt.tight_layout()
-    save_path = os.path.join(save_dirs[(row['Main_Folder'], row['Subdirectory'])], "pitch", f"{row['File']}_pitch.png")
+    save_path = os.path.join(save_dir, "pitch", f"{row['File']}_pitch.png")
     plt.savefig(save_path)
     plt.close()
-    
-    # Print confirmation
-    print(f"Plotted and saved: {row['File']}_pitch.png")
 
 # Process each row for visualization
-def process_row(row):
-    visualize_contrast_chroma(row)
-    visualize_zcr_rms(row)
-    visualize_centroid_bandwidth(row)
-    visualize_pitch(row)
+def process_row(row, save_dir):
+    start = time.perf_counter()
+    try:
+        visualize_contrast_chroma(row, save_dir)
+        visualize_zcr_rms(row, save_dir)
+        visualize_centroid_bandwidth(row, save_dir)
+        visualize_pitch(row, save_dir)
+        metrics.item(time.perf_counter() - start)
+    except Exception as e:
+        # Counted per error type instead of printed per row
+        metrics.item(time.perf_counter() - start, ok=False)
+        metrics.incr(f"error_{type(e).__name__}")
+
+# Process a batch of rows; the task carries the save directories, so workers never read the CSV
+def process_rows(task):
+    rows, save_dirs = task
+    for row in rows:
+        process_row(row, save_dirs[(row['Main_Folder'], row['Subdirectory'])])
+    return metrics.drain()
 
 # Parallel Processing (Optional)
 if __name__ == "__main__":
-    with ProcessPoolExecutor(max_workers=75) as executor:
-        executor.map(process_row, [row for _, row in df.iterrows()])
+    # Load the extracted features CSV
+    df = pd.read_csv(csv_path)
+    # Get save directories for each combination of Main_Folder and Subdirectory
+    save_dirs = create_save_directories(df)
+    tasks = ((df.iloc[i:i + ROWS_PER_TASK].to_dict("records"), save_dirs) for i in range(0, len(df), ROWS_PER_TASK))
+    metrics.total = len(df)
+    with SharedExecutor("plots", task_weight=ROWS_PER_TASK) as executor:
+        for snapshot in executor.map_unordered(process_rows, tasks):
+            metrics.merge(snapshot)
+            metrics.report()
+    metrics.report(force=True)
+    metrics.write_json()
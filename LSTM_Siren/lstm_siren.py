@@ -0,0 +1,108 @@
+import os
+import sys
+import numpy as np
+import matplotlib.pyplot as plt
+from sklearn.model_selection import train_test_split
+from tensorflow.keras import layers, models
+from tensorflow.keras.optimizers import Adam
+
+# The training profiler lives with the CNN in neural-networks-and-results
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "neural-networks-and-results"))
+from training_profiler import TrainingProfiler, profiling_enabled
+from sequence_dataset import SEQUENCE_SHAPE, build_sequence_memmap, SequenceDataset
+
+# Define paths to the Firetruck and Unknown subdirectories
+firetruck_dir = '/content/FiretruckSpectrograms/Firetruck'
+unknown_dir = '/content/UnknownSpectrograms/Unknown'
+results_dir = '/content'
+# Disk-backed cache of preprocessed sequences
+sequence_cache_dir = '/content/sequence_cache'
+
+# Function to list all spectrograms in a directory with their labels
+def list_spectrograms_in_directory(directory):
+    image_paths = []
+    labels = []
+
+    # Iterate through all files in the directory
+    for file_name in os.listdir(directory):
+        if file_name.endswith('.png'):
+            image_paths.append(os.path.join(directory, file_name))
+
+            # Label: 1 for firetruck, 0 for unknown
+            label = 1 if 'Firetruck' in directory else 0
+            labels.append(label)
+
+    return image_paths, labels
+
+# Define a modified LSTM model with tanh activation
+def build_model():
+    model = models.Sequential([
+        layers.LSTM(128, activation='tanh', input_shape=SEQUENCE_SHAPE, return_sequences=True),
+        layers.LSTM(64, activation='tanh'),
+        layers.Dense(64, activation='tanh'),
+        layers.Dense(1, activation='sigmoid')  # Binary classification
+    ])
+
+    # Compile the model with a smaller learning rate and gradient clipping
+    optimizer = Adam(learning_rate=0.0001, clipvalue=1.0)
+    model.compile(optimizer=optimizer,
+                  loss='binary_crossentropy',
+                  metrics=['accuracy'])
+    return model
+
+# Plot training & validation accuracy and loss
+def plot_history(history):
+    plt.plot(history.history['accuracy'], label='train accuracy')
+    plt.plot(history.history['val_accuracy'], label='val accuracy')
+    plt.legend(loc='lower right')
+    plt.title('Model Accuracy')
+    plt.xlabel('Epoch')
+    plt.ylabel('Accuracy')
+    plt.savefig(os.path.join(results_dir, 'lstm_accuracy.png'))
+    plt.close()
+
+    plt.plot(history.history['loss'], label='train loss')
+    plt.plot(history.history['val_loss'], label='val loss')
+    plt.legend(loc='upper right')
+    plt.title('Model Loss')
+    plt.xlabel('Epoch')
+    plt.ylabel('Loss')
+    plt.savefig(os.path.join(results_dir, 'lstm_loss.png'))
+    plt.close()
+
+def main():
+    # List firetruck and unknown spectrograms
+    firetruck_paths, firetruck_labels = list_spectrograms_in_directory(firetruck_dir)
+    unknown_paths, unknown_labels = list_spectrograms_in_directory(unknown_dir)
+    image_paths = firetruck_paths + unknown_paths
+    labels = np.array(firetruck_labels + unknown_labels)
+
+    # Preprocess into an on-disk memmap; mean/std are computed in the same streaming pass
+    build_sequence_memmap(image_paths, labels, sequence_cache_dir)
+    print(f"Sequences shape: {(len(image_paths),) + SEQUENCE_SHAPE}")
+
+    # Split indices rather than arrays; batches are standardised lazily when read
+    batch_size = 32
+    train_idx, val_idx = train_test_split(np.arange(len(labels)), test_size=0.2, random_state=42)
+    train_data = SequenceDataset(sequence_cache_dir, train_idx, batch_size=batch_size, shuffle=True)
+    val_data = SequenceDataset(sequence_cache_dir, val_idx, batch_size=batch_size)
+    print(f"Train sequences: {len(train_idx)}")
+    print(f"Val sequences: {len(val_idx)}")
+
+    model = build_model()
+
+    # Opt-in step-time instrumentation (PROFILE_TRAINING=1); the profiler times the dataset's batch reads
+    callbacks = []
+    if profiling_enabled():
+        profiler = TrainingProfiler(results_dir, batch_size=batch_size, prefix="lstm")
+        callbacks.append(profiler)
+        train_data = profiler.wrap(train_data)
+
+    # Train the model
+    history = model.fit(train_data, validation_data=val_data, epochs=50, callbacks=callbacks)
+
+    plot_history(history)
+    model.save(os.path.join(results_dir, 'firetruck_vs_unknown_lstm_model.h5'))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,164 @@
+import os
+import json
+import hashlib
+import cv2
+import numpy as np
+import tensorflow as tf
+
+# Shape of one LSTM input sequence: 224 time steps of 224 * 3 features
+SEQUENCE_SHAPE = (224, 672)
+
+
+# Function to preprocess spectrograms and convert them into LSTM-compatible sequences
+def preprocess_spectrogram_to_sequence(image_path, target_size=(224, 224)):
+    """
+    Convert spectrogram image to a sequence suitable for LSTM input.
+    - Input: Path to the spectrogram image
+    - Output: Reshaped numpy array (time_steps, features)
+    """
+    # Read the image using OpenCV
+    img = cv2.imread(image_path)
+
+    # Resize the image to the target size (224x224)
+    img = cv2.resize(img, target_size)
+
+    # Normalize the image (scale pixel values to [0, 1])
+    img = img.astype('float32') / 255.0
+
+    # Reshape the image into a sequence (time_steps, features)
+    # The time_steps correspond to the height (224) and features to the width * channels (224*3)
+    img = np.reshape(img, (target_size[0], target_size[1] * 3))  # (224, 224*3)
+
+    return img
+
+
+class RunningStats:
+    """
+    Streaming mean/variance over every value seen (Welford's algorithm,
+    combined a block at a time with Chan's parallel update).
+
+    Gives the same result as np.mean / np.std over the full array without
+    ever holding it in memory.
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+
+    def update(self, block):
+        block = np.asarray(block, dtype=np.float64)
+        n = block.size
+        if n == 0:
+            return
+        block_mean = block.mean()
+        block_m2 = np.square(block - block_mean).sum()
+
+        total = self.count + n
+        delta = block_mean - self.mean
+        self.mean += delta * n / total
+        self.m2 += block_m2 + delta * delta * self.count * n / total
+        self.count = total
+
+    @property
+    def std(self):
+        return float(np.sqrt(self.m2 / self.count)) if self.count else 0.0
+
+
+def build_sequence_memmap(image_paths, labels, output_dir, target_size=(224, 224)):
+    """
+    Preprocess spectrograms one at a time into a disk-backed sequences.npy memmap.
+
+    Mean/std are accumulated in the same pass and stored in stats.json, so the
+    full dataset is never loaded into RAM. An existing cache built from the same
+    images (path, size and mtime of each), labels and target_size is reused.
+
+    Args:
+    - image_paths: Spectrogram image paths, in dataset order.
+    - labels: Label for each image.
+    - output_dir: Directory for sequences.npy, labels.npy and stats.json.
+    - target_size: Image size before reshaping into (time_steps, features).
+
+    Returns the path to output_dir.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    sequences_path = os.path.join(output_dir, "sequences.npy")
+    stats_path = os.path.join(output_dir, "stats.json")
+    h = hashlib.sha1(json.dumps([list(target_size), [int(label) for label in labels]]).encode("utf-8"))
+    for image_path in image_paths:
+        # Re-rendered images keep their names, so size and mtime are part of the key
+        st = os.stat(image_path)
+        h.update(f"{image_path}\0{st.st_size}\0{st.st_mtime_ns}\n".encode("utf-8"))
+    paths_digest = h.hexdigest()
+
+    if os.path.exists(stats_path):
+        with open(stats_path) as f:
+            if json.load(f).get("paths_digest") == paths_digest:
+                print(f"Reusing sequence cache in {output_dir}")
+                return output_dir
+        # Stale cache: drop the stats first so a partial rebuild is never reused
+        os.remove(stats_path)
+
+    shape = (len(image_paths), target_size[0], target_size[1] * 3)
+    sequences = np.lib.format.open_memmap(sequences_path, mode="w+", dtype=np.float32, shape=shape)
+    stats = RunningStats()
+
+    for i, image_path in enumerate(image_paths):
+        sequence = preprocess_spectrogram_to_sequence(image_path, target_size)
+        sequences[i] = sequence
+        stats.update(sequence)
+
+    sequences.flush()
+    del sequences
+    np.save(os.path.join(output_dir, "labels.npy"), np.asarray(labels, dtype=np.int32))
+
+    # Written last so an interrupted build is not mistaken for a complete cache
+    with open(stats_path, "w") as f:
+        json.dump({"count_sequences": len(image_paths), "paths_digest": paths_digest, "mean": stats.mean, "std": stats.std}, f, indent=2)
+
+    print(f"Sequences written to {sequences_path} (mean={stats.mean:.4f}, std={stats.std:.4f})")
+    return output_dir
+
+
+class SequenceDataset(tf.keras.utils.Sequence):
+    """
+    Keras Sequence over a sequence memmap built by build_sequence_memmap.
+
+    Batches are read from disk on demand and standardised with the stored
+    mean/std, so only one batch is ever resident in memory.
+
+    Args:
+    - cache_dir: Directory written by build_sequence_memmap.
+    - indices: Subset of sequence indices to serve (e.g. the training split).
+    - batch_size: Sequences per batch.
+    - shuffle: Reshuffle the indices at the end of every epoch.
+    """
+
+    def __init__(self, cache_dir, indices=None, batch_size=32, shuffle=False, **kwargs):
+        super().__init__(**kwargs)
+        self.sequences = np.load(os.path.join(cache_dir, "sequences.npy"), mmap_mode="r")
+        self.labels = np.load(os.path.join(cache_dir, "labels.npy"))
+        with open(os.path.join(cache_dir, "stats.json")) as f:
+            stats = json.load(f)
+        self.mean = np.float32(stats["mean"])
+        self.std = np.float32(stats["std"])
+        self.indices = np.arange(len(self.labels)) if indices is None else np.asarray(indices)
+        self.batch_size = batch_size
+        self.shuffle = shuffle
+        if self.shuffle:
+            np.random.shuffle(self.indices)
+
+    def __len__(self):
+        return int(np.ceil(len(self.indices) / self.batch_size))
+
+    def __getitem__(self, idx):
+        # Sorted reads keep access to the memmap as sequential as possible
+        batch = np.sort(self.indices[idx * self.batch_size:(idx + 1) * self.batch_size])
+        x = np.asarray(self.sequences[batch])
+        x -= self.mean
+        x /= self.std
+        return x, self.labels[batch]
+
+    def on_epoch_end(self):
+        if self.shuffle:
+            np.random.shuffle(self.indices)
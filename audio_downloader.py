@@ -2,8 +2,17 @@ import yt_dlp
 from pydub import AudioSegment
 import os
 import csv
-from concurrent.futures import ProcessPoolExecutor, as_completed
+import time
 from yt_dlp.utils import DownloadError  # Import the specific error class
+import manifest
+import pipeline_config
+from pipeline_metrics import StageMetrics
+from pipeline_executor import SharedExecutor
+
+# Define the main folders containing subfolders with CSV files
+main_folders = pipeline_config.main_folders()
+
+metrics = StageMetrics("download")
 
 def get_video_id_and_start_time(file_string):
     """Extract YouTube ID and start time from the format like 'zfI3S4Pgqg0_5000'."""
@@ -12,24 +21,26 @@ def get_video_id_and_start_time(file_string):
         start_time = int(start_time) / 1000.0  # Convert to seconds (from milliseconds)
         return ytid.strip(), start_time
     except ValueError:
-        print(f"Invalid format in the string: {file_string}")
+        # Counted as invalid_segment_id by the caller
         return None, None
 
-def count_files_in_directory(directory):
-    """Count the number of files in a directory."""
-    return sum(len(files) for _, _, files in os.walk(directory))
-
 def extract_audio_segment(video_id, start_time, end_time, output_folder):
-    """Download and trim the audio segment."""
+    """Download and trim the audio segment. Returns the outcome ('downloaded', 'exists', ...)."""
     try:
-        # Check if the total number of files in the output folder is less than 1004
-        if count_files_in_directory(output_folder) >= 1004:
-            print(f"Total number of files in {output_folder} has reached or exceeded 1004. Skipping video {video_id}.")
-            return
+        conn = manifest.connect()
+        main_folder, subdirectory = manifest.split_class_path(output_folder, main_folders)
+        segment_id = f"{video_id}_{int(start_time * 1000)}"
+        clip_id = manifest.add_clip(conn, main_folder, subdirectory, segment_id=segment_id)
+        # Already downloaded, or downloaded and trimmed (the trimmer deletes the original)
+        if manifest.stage_file(conn, clip_id, "download") or manifest.has_source(conn, main_folder, subdirectory, video_id):
+            return "exists"
+
+        # Check if the number of downloaded sources for this class (trimmed or not) is below the configured limit
+        if manifest.count_sources(conn, main_folder, subdirectory) >= pipeline_config.config["download_limit_per_class"]:
+            return "class_full"
         audio_file = f"{output_folder}/{video_id}" 
         if os.path.exists(f"{audio_file}.m4a") or os.path.exists(f"{audio_file}.webm"):
-            print(f"{video_id} Already Exists")
-            return
+            return "exists"
         
         # yt-dlp options to download the best audio
         ydl_opts = {
@@ -51,8 +62,7 @@ def extract_audio_segment(video_id, start_time, end_time, output_folder):
                 ydl.extract_info(f"https://www.youtube.com/watch?v={video_id}", download=True)
                 audio_file = f"{output_folder}/{video_id}.wav"
             except DownloadError:
-                print(f"Video {video_id} is unavailable. Skipping.")
-                return
+                return "unavailable"
 
         # Load the audio file and trim it using Pydub
         audio = AudioSegment.from_wav(audio_file)
@@ -63,33 +73,40 @@ def extract_audio_segment(video_id, start_time, end_time, output_folder):
 
         # Export the trimmed audio back to the same file or a new file
         trimmed_audio.export(audio_file, format="wav")
-        print(f"Trimmed audio saved as: {audio_file}")
+        manifest.record_file(conn, clip_id, "download", audio_file)
+        return "downloaded"
     except Exception as e:
-        print(f"Error processing video {video_id}: {str(e)}")
+        # Counted per error type instead of printed per video
+        metrics.incr(f"error_{type(e).__name__}")
+        return "error"
 
 def process_single_entry(csv_file):
-    """Process all entries in a CSV file."""
+    """Process all entries in a CSV file. Returns the metrics snapshot of this worker."""
     try:
         csv_folder = os.path.dirname(csv_file)
 
         with open(csv_file, newline='', encoding='utf-8') as file:
             reader = csv.DictReader(file)
-            print("CSV Headers:", reader.fieldnames)
 
             # Iterate through all rows in the CSV
             for row in reader:
                 file_string = row[' segment_id'].strip()  # Extract the string like 'zfI3S4Pgqg0_5000'
                 video_id, start_time = get_video_id_and_start_time(file_string)
                 if video_id is not None and start_time is not None:
+                    start = time.perf_counter()
                     try:
                         end_time = start_time + 10
-                        extract_audio_segment(video_id, start_time, end_time, csv_folder)
+                        outcome = extract_audio_segment(video_id, start_time, end_time, csv_folder)
                     except ValueError:
-                        print(f"Skipping video {video_id}: Invalid end time.")
-            else:
-                print(f"Finished processing {csv_file}")
+                        outcome = "error"
+                    metrics.item(time.perf_counter() - start, ok=outcome != "error")
+                    metrics.incr(outcome)
+                else:
+                    metrics.incr("invalid_segment_id")
+        metrics.incr("csv_files")
     except Exception as e:
-        print(f"Error processing CSV file {csv_file}: {str(e)}")
+        metrics.incr(f"csv_error_{type(e).__name__}")
+    return metrics.drain()
 
 def process_csv_files_in_folder(folder):
     """Iterate through all directories and process CSV files found."""
@@ -101,29 +118,29 @@ def process_csv_files_in_folder(folder):
                 csv_files.append(csv_file)
     return csv_files
 
-def process_folders_in_parallel(folders, num_cores=75):
-    """Process the folders in parallel using multiple cores."""
-    with ProcessPoolExecutor(max_workers=num_cores) as executor:
-        futures = []
-        
-        for folder in folders:
-            csv_files = process_csv_files_in_folder(folder)
-            for csv_file in csv_files:
-                futures.append(executor.submit(process_single_entry, csv_file))
-        
-        # Wait for all futures to complete
-        for future in as_completed(futures):
-            try:
-                future.result()  # Will raise an exception if processing failed
-            except Exception as e:
-                print(f"Error during processing: {e}")
+def process_folders_in_parallel(folders, max_workers=None):
+    """Process the folders in parallel; downloads wait on the network, so the pool is sized for I/O."""
+    csv_files = [csv_file for folder in folders for csv_file in process_csv_files_in_folder(folder)]
+    # Files from before the manifest existed count towards the limits and are not downloaded again
+    conn = manifest.connect()
+    for class_dir in sorted({os.path.dirname(csv_file) for csv_file in csv_files}):
+        main_folder, subdirectory = manifest.split_class_path(class_dir, main_folders)
+        metrics.incr("imported_files", manifest.import_class_directory(conn, class_dir, main_folder, subdirectory))
+    with SharedExecutor("download", kind="io", max_workers=max_workers) as executor:
+        # Aggregate worker metrics as CSV files finish
+        for result in executor.map_unordered(process_single_entry, csv_files, return_exceptions=True):
+            if isinstance(result, Exception):
+                metrics.incr(f"worker_error_{type(result).__name__}")
+            else:
+                metrics.merge(result)
+            metrics.report()
 
-def main():
-    # Define the main folders containing subfolders with CSV files
-    main_folders = ['emergency sounds', 'normal sounds']
+    metrics.report(force=True)
+    metrics.write_json()
 
-    # Process the folders in parallel (60 cores)
-    process_folders_in_parallel(main_folders, num_cores=60)
+def main():
+    # Process the folders in parallel, with as many workers as the node can take
+    process_folders_in_parallel(main_folders)
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,304 @@
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import socket
+import argparse
+import platform
+import tempfile
+import subprocess
+from concurrent.futures import ProcessPoolExecutor
+
+# Repository root and the analysis scripts the hot paths live in
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.append(ROOT)
+sys.path.append(os.path.join(ROOT, "Data_Analysis"))
+
+from synthetic_corpus import generate_corpus
+
+BENCHMARKS = ("features", "augment", "trim", "cnn_input")
+DEFAULT_OUTPUT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "results.jsonl")
+AUG_TYPES = ["speed", "noise", "pitch", "echo"]
+
+
+def write_bench_config(workdir):
+    """
+    Point the pipeline configuration, manifest and metrics at a scratch directory.
+
+    Must run before any pipeline module is imported, since they read the
+    configuration at import time.
+    """
+    with open(os.path.join(ROOT, "pipeline.json")) as f:
+        config = json.load(f)
+    config.update({
+        "emergency_sounds_dir": os.path.join(workdir, "corpus", "emergency sounds"),
+        "normal_sounds_dir": os.path.join(workdir, "corpus", "normal sounds"),
+        "features_csv": os.path.join(workdir, "features.csv"),
+        "manifest_path": os.path.join(workdir, "manifest.db"),
+        "metrics_dir": os.path.join(workdir, "metrics"),
+    })
+    path = os.path.join(workdir, "pipeline.json")
+    with open(path, "w") as f:
+        json.dump(config, f, indent=4)
+    os.environ["PIPELINE_CONFIG"] = path
+    os.environ["MANIFEST_PATH"] = config["manifest_path"]
+    os.environ["METRICS_DIR"] = config["metrics_dir"]
+    # Keep progress lines out of the timings
+    os.environ["METRICS_REPORT_INTERVAL"] = "1e9"
+
+
+def git_commit():
+    """Current commit and whether the working tree has local changes."""
+    try:
+        commit = subprocess.check_output(["git", "rev-parse", "HEAD"], cwd=ROOT, text=True).strip()
+        dirty = bool(subprocess.check_output(["git", "status", "--porcelain", "--untracked-files=no"],
+                                             cwd=ROOT, text=True).strip())
+        return commit, dirty
+    except (OSError, subprocess.CalledProcessError):
+        return None, None
+
+
+def machine_info():
+    """Enough about the host to tell whether two result files are comparable."""
+    info = {
+        "host": socket.gethostname(),
+        "platform": platform.platform(),
+        "processor": platform.processor() or platform.machine(),
+        "cpu_count": os.cpu_count(),
+        "python": platform.python_version(),
+    }
+    if hasattr(os, "sched_getaffinity"):
+        info["cpus_available"] = len(os.sched_getaffinity(0))
+    try:
+        with open("/proc/meminfo") as f:
+            info["mem_total_kb"] = int(f.readline().split()[1])
+    except (OSError, IndexError, ValueError):
+        pass
+    for module in ("numpy", "librosa", "pydub", "tensorflow"):
+        try:
+            info[f"{module}_version"] = __import__(module).__version__
+        except Exception:
+            info[f"{module}_version"] = None
+    return info
+
+
+# Pool tasks: module level so they pickle, importing the pipeline modules lazily
+def features_task(path):
+    from feature_extraction import extract_features
+    return 1 if extract_features(path, "bench", "bench") else 0
+
+
+def augment_task(task):
+    from data_aug import augment_audio
+    path, output_dir, aug_type, index = task
+    random.seed(index)
+    augment_audio(path, output_dir, aug_type, os.path.splitext(os.path.basename(path))[0], index)
+    return 1
+
+
+def trim_task(task):
+    import trimmer
+    _, snapshot = trimmer.process_directory(*task)
+    return snapshot["items"]
+
+
+def run_pool(fn, tasks, workers):
+    """Run tasks inline for one worker, else in a process pool; returns the summed task results."""
+    if workers == 1:
+        return sum(fn(task) for task in tasks)
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        return sum(executor.map(fn, tasks, chunksize=max(1, len(tasks) // (workers * 4))))
+
+
+def bench_features(corpus, workdir, workers):
+    return run_pool(features_task, corpus["wavs"], workers)
+
+
+def bench_augment(corpus, workdir, workers):
+    output_dir = os.path.join(workdir, "augmented")
+    shutil.rmtree(output_dir, ignore_errors=True)
+    os.makedirs(output_dir)
+    tasks = [(path, output_dir, AUG_TYPES[i % len(AUG_TYPES)], i) for i, path in enumerate(corpus["wavs"])]
+    return run_pool(augment_task, tasks, workers)
+
+
+def bench_trim(corpus, workdir, workers):
+    return run_pool(trim_task, [(os.path.dirname(path), os.path.basename(path)) for path in corpus["csvs"]], workers)
+
+
+def bench_cnn_input(corpus, workdir, workers):
+    """One pass over the spectrograms through the same generator settings as cnn.py."""
+    import pandas as pd
+    from tensorflow.keras.preprocessing.image import ImageDataGenerator
+    frame = pd.DataFrame(corpus["spectrograms"], columns=["file_path", "label"])
+    generator = ImageDataGenerator(rescale=1./255).flow_from_dataframe(
+        frame, x_col="file_path", y_col="label", target_size=(224, 224), class_mode="binary", batch_size=32)
+    images = 0
+    for i in range(len(generator)):
+        images += len(generator[i][0])
+    return images
+
+
+RUNNERS = {
+    "features": bench_features,
+    "augment": bench_augment,
+    "trim": bench_trim,
+    "cnn_input": bench_cnn_input,
+}
+
+
+def reset_trim_outputs(corpus):
+    """Remove trimmed clips and manifest records so every trim run does the full work."""
+    sources = set(corpus["wavs"])
+    for class_dir in corpus["class_dirs"]:
+        for name in os.listdir(class_dir):
+            path = os.path.join(class_dir, name)
+            if name.endswith(".wav") and path not in sources:
+                os.remove(path)
+    import manifest
+    for suffix in ("", "-wal", "-shm"):
+        if os.path.exists(manifest.MANIFEST_PATH + suffix):
+            os.remove(manifest.MANIFEST_PATH + suffix)
+
+
+def run(benchmarks, sizes, workers_list, repeat, output, workdir):
+    """
+    Time every benchmark at every corpus size and worker count, appending one JSON line per combination.
+
+    The best of `repeat` runs is reported as `seconds`; all runs are kept in `runs_s`.
+    """
+    if "cnn_input" in benchmarks:
+        try:
+            import PIL  # noqa: F401  (spectrogram rendering)
+        except ImportError as e:
+            print(f"[bench] cnn_input: skipped ({e})")
+            benchmarks = [name for name in benchmarks if name != "cnn_input"]
+    commit, dirty = git_commit()
+    machine = machine_info()
+    corpus_dir = os.path.join(workdir, "corpus")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+
+    for clips_per_class in sizes:
+        shutil.rmtree(corpus_dir, ignore_errors=True)
+        corpus = generate_corpus(corpus_dir, clips_per_class, spectrograms="cnn_input" in benchmarks)
+        for name in benchmarks:
+            # The generator decodes in the calling thread; worker counts do not apply
+            for workers in ([1] if name == "cnn_input" else workers_list):
+                runs, items = [], 0
+                try:
+                    for _ in range(repeat):
+                        if name == "trim":
+                            reset_trim_outputs(corpus)
+                        start = time.perf_counter()
+                        items = RUNNERS[name](corpus, workdir, workers)
+                        runs.append(time.perf_counter() - start)
+                except ImportError as e:
+                    print(f"[bench] {name}: skipped ({e})")
+                    break
+                seconds = min(runs)
+                record = {
+                    "benchmark": name,
+                    "clips_per_class": clips_per_class,
+                    "clips": len(corpus["wavs"]),
+                    "workers": workers,
+                    "items": items,
+                    "seconds": seconds,
+                    "runs_s": runs,
+                    "items_per_sec": items / seconds if seconds > 0 else 0.0,
+                    "commit": commit,
+                    "dirty": dirty,
+                    "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+                    "machine": machine,
+                }
+                with open(output, "a") as f:
+                    f.write(json.dumps(record) + "\n")
+                print(f"[bench] {name:<10} clips/class={clips_per_class:<5} workers={workers:<3} "
+                      f"{seconds:8.3f}s  {record['items_per_sec']:8.1f} items/s")
+
+
+def load_results(path):
+    """Latest record per (benchmark, clips_per_class, workers) in a results file."""
+    results = {}
+    with open(path) as f:
+        for line in f:
+            if line.strip():
+                record = json.loads(line)
+                results[(record["benchmark"], record["clips_per_class"], record["workers"])] = record
+    return results
+
+
+def compare(baseline_path, candidate_path, threshold=0.1):
+    """
+    Print the change in time of every benchmark present in both files.
+
+    Returns the number of regressions, i.e. benchmarks slower than the baseline
+    by more than `threshold` (a fraction).
+    """
+    baseline, candidate = load_results(baseline_path), load_results(candidate_path)
+    shared = sorted(set(baseline) & set(candidate))
+    if not shared:
+        print("No benchmarks in common.")
+        return 0
+
+    b_machine, c_machine = baseline[shared[0]]["machine"], candidate[shared[0]]["machine"]
+    print(f"baseline:  {baseline[shared[0]]['commit']} on {b_machine['host']}")
+    print(f"candidate: {candidate[shared[0]]['commit']} on {c_machine['host']}")
+    if (b_machine.get("cpus_available"), b_machine["processor"]) != (c_machine.get("cpus_available"), c_machine["processor"]):
+        print("Warning: results come from different machines.")
+
+    regressions = 0
+    print(f"{'benchmark':<10} {'clips/class':>11} {'workers':>7} {'baseline s':>11} {'candidate s':>11} {'change':>8}")
+    for key in shared:
+        old, new = baseline[key]["seconds"], candidate[key]["seconds"]
+        change = (new - old) / old if old > 0 else 0.0
+        flag = ""
+        if change > threshold:
+            flag = "  REGRESSION"
+            regressions += 1
+        elif change < -threshold:
+            flag = "  improved"
+        print(f"{key[0]:<10} {key[1]:>11} {key[2]:>7} {old:>11.3f} {new:>11.3f} {change:>+8.1%}{flag}")
+    return regressions
+
+
+def int_list(value):
+    return [int(v) for v in value.split(",")]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the audio hot paths on a synthetic corpus.")
+    sub = parser.add_subparsers(dest="command", required=True)
+    run_parser = sub.add_parser("run", help="Run benchmarks and append the results.")
+    run_parser.add_argument("--benchmarks", default=",".join(BENCHMARKS), help=f"Comma separated: {', '.join(BENCHMARKS)}.")
+    run_parser.add_argument("--sizes", type=int_list, default=[4, 16, 64], help="Clips per class, comma separated.")
+    run_parser.add_argument("--workers", type=int_list, default=[1, 2, 4], help="Worker counts, comma separated.")
+    run_parser.add_argument("--repeat", type=int, default=3, help="Runs per combination; the fastest is reported.")
+    run_parser.add_argument("--output", default=DEFAULT_OUTPUT, help="JSON lines file the results are appended to.")
+    run_parser.add_argument("--workdir", help="Scratch directory for the corpus (default: a temporary directory).")
+    compare_parser = sub.add_parser("compare", help="Compare two results files.")
+    compare_parser.add_argument("baseline")
+    compare_parser.add_argument("candidate")
+    compare_parser.add_argument("--threshold", type=float, default=0.1, help="Slowdown fraction counted as a regression.")
+    args = parser.parse_args()
+
+    if args.command == "compare":
+        sys.exit(1 if compare(args.baseline, args.candidate, args.threshold) else 0)
+
+    benchmarks = args.benchmarks.split(",")
+    unknown = [name for name in benchmarks if name not in RUNNERS]
+    if unknown:
+        parser.error(f"Unknown benchmarks: {', '.join(unknown)}")
+    workdir = args.workdir or tempfile.mkdtemp(prefix="audio-bench-")
+    os.makedirs(workdir, exist_ok=True)
+    write_bench_config(workdir)
+    try:
+        run(benchmarks, args.sizes, args.workers, args.repeat, args.output, workdir)
+    finally:
+        if not args.workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,115 @@
+import os
+import csv
+import wave
+import argparse
+import numpy as np
+
+SAMPLE_RATE = 22050
+CLIP_SECONDS = 10.0
+
+# Class folders of the synthetic corpus and the kind of signal each one holds
+CLASSES = {
+    "emergency sounds": {"Siren": "chirp", "Alarm": "beeps"},
+    "normal sounds": {"Wind": "noise", "Engine": "hum"},
+}
+
+
+def synth_signal(kind, rng, seconds=CLIP_SECONDS, sr=SAMPLE_RATE):
+    """Deterministic test signal in [-1, 1] for one clip."""
+    t = np.arange(int(seconds * sr)) / sr
+    if kind == "chirp":
+        # Siren-like sweep between two frequencies
+        f0, f1 = rng.uniform(500, 800), rng.uniform(1200, 1800)
+        period = rng.uniform(0.8, 2.0)
+        phase = 2 * np.pi * (f0 * t + (f1 - f0) * period / (2 * np.pi) * (1 - np.cos(2 * np.pi * t / period)) / 2)
+        y = 0.6 * np.sin(phase)
+    elif kind == "beeps":
+        # On/off tone
+        gate = (np.floor(t * rng.uniform(2, 6)) % 2 == 0).astype(np.float64)
+        y = 0.5 * gate * np.sin(2 * np.pi * rng.uniform(900, 3000) * t)
+    elif kind == "noise":
+        # Slowly modulated noise
+        y = 0.3 * rng.standard_normal(len(t)) * (0.6 + 0.4 * np.sin(2 * np.pi * rng.uniform(0.1, 0.5) * t))
+    else:
+        # Low harmonic hum
+        f = rng.uniform(40, 120)
+        y = sum(0.3 / k * np.sin(2 * np.pi * k * f * t) for k in range(1, 5))
+    return np.clip(y, -1.0, 1.0)
+
+
+def write_wav(path, y, sr=SAMPLE_RATE):
+    """Write a mono 16-bit PCM WAV."""
+    with wave.open(path, "wb") as w:
+        w.setnchannels(1)
+        w.setsampwidth(2)
+        w.setframerate(sr)
+        w.writeframes((y * 32767).astype("<i2").tobytes())
+
+
+def write_spectrogram_png(path, y, sr=SAMPLE_RATE):
+    """Log-magnitude STFT rendered as an RGB PNG, like the spectrogram images the CNN is trained on."""
+    from PIL import Image
+    n_fft, hop = 1024, 512
+    frames = np.lib.stride_tricks.sliding_window_view(y, n_fft)[::hop] * np.hanning(n_fft)
+    magnitude = np.log1p(np.abs(np.fft.rfft(frames, axis=1))).T[::-1]
+    image = (255 * magnitude / max(magnitude.max(), 1e-9)).astype(np.uint8)
+    Image.fromarray(image).convert("RGB").resize((640, 480)).save(path)
+
+
+def generate_corpus(root, clips_per_class, seed=0, spectrograms=False):
+    """
+    Generate a deterministic corpus in the 'emergency sounds/<class>' layout.
+
+    Every class folder gets clips_per_class 10-second source WAVs named
+    '<source id>.wav' and a segment CSV (segment id, start, end, label) with two
+    windows per source, in the format trimmer.py reads. With spectrograms=True
+    a PNG per source is also written to '<root>/spectrograms/<label>'.
+
+    Returns a dict with the class directories, source WAVs, segment CSVs and
+    (source path, label) pairs of the spectrograms.
+    """
+    corpus = {"class_dirs": [], "wavs": [], "csvs": [], "spectrograms": []}
+    for main_folder, classes in CLASSES.items():
+        label = "emergency" if main_folder == "emergency sounds" else "normal"
+        for class_index, (class_name, kind) in enumerate(sorted(classes.items())):
+            class_dir = os.path.join(root, main_folder, class_name)
+            os.makedirs(class_dir, exist_ok=True)
+            corpus["class_dirs"].append(class_dir)
+            rows = []
+            for i in range(clips_per_class):
+                rng = np.random.RandomState(seed * 1000003 + class_index * 10007 + i)
+                source_id = f"{class_name.lower()}{i:05d}"
+                y = synth_signal(kind, rng)
+                path = os.path.join(class_dir, f"{source_id}.wav")
+                write_wav(path, y)
+                corpus["wavs"].append(path)
+                rows.append((f"{source_id}_0", 0.5, 3.5, class_name))
+                rows.append((f"{source_id}_0", 5.0, 9.0, class_name))
+                if spectrograms:
+                    spectrogram_dir = os.path.join(root, "spectrograms", label)
+                    os.makedirs(spectrogram_dir, exist_ok=True)
+                    png = os.path.join(spectrogram_dir, f"{source_id}_spectrogram.png")
+                    write_spectrogram_png(png, y)
+                    corpus["spectrograms"].append((png, label))
+            csv_path = os.path.join(class_dir, "segments.csv")
+            with open(csv_path, mode="w", newline="") as file:
+                writer = csv.writer(file)
+                writer.writerow(["segment_id", "start_time_seconds", "end_time_seconds", "label"])
+                writer.writerows(rows)
+            corpus["csvs"].append(csv_path)
+    return corpus
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate a deterministic synthetic audio corpus.")
+    parser.add_argument("root")
+    parser.add_argument("--clips-per-class", type=int, default=16)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--spectrograms", action="store_true")
+    args = parser.parse_args()
+    corpus = generate_corpus(args.root, args.clips_per_class, args.seed, args.spectrograms)
+    print(f"Generated {len(corpus['wavs'])} clips in {len(corpus['class_dirs'])} class folders under {args.root}")
+
+
+if __name__ == "__main__":
+    main()
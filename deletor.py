@@ -1,10 +1,16 @@
 import pandas as pd
+import manifest
+from pipeline_config import config
 
 # Define the file path of the CSV
-csv_file = "Data_Analysis/extracted_features.csv"  # Replace with the path to your CSV file
+csv_file = config["features_csv"]
 
 # Define the entries to be removed
-entries_to_remove = ['Tick', 'Wind', 'Wind noise (Microphone)']  # Replace with your specific entries
+entries_to_remove = config["excluded_classes"]
+
+# Exclude the clips of these classes from every later stage via the manifest
+excluded = manifest.exclude_subdirectories(manifest.connect(), entries_to_remove)
+print(f"Marked {excluded} clips as excluded in the manifest.")
 
 # Load the CSV file into a DataFrame
 df = pd.read_csv(csv_file)
@@ -13,7 +19,7 @@ df = pd.read_csv(csv_file)
 df_filtered = df[~df['Subdirectory'].isin(entries_to_remove)]
 
 # Save the filtered DataFrame back to a CSV file
-output_file = "filtered_file.csv"  # Replace with the desired output file path
+output_file = config["filtered_features_csv"]
 df_filtered.to_csv(output_file, index=False)
 
 print(f"Rows containing {entries_to_remove} in the 'subdirectory' column have been removed.")
@@ -0,0 +1,523 @@
+import os
+import re
+import time
+import random
+import sqlite3
+import hashlib
+from pipeline_config import config
+
+# Location of the dataset manifest (override with MANIFEST_PATH)
+MANIFEST_PATH = os.environ.get("MANIFEST_PATH", config["manifest_path"])
+
+# Label used by the models for each main folder
+LABELS = {'emergency sounds': 'emergency', 'normal sounds': 'normal'}
+
+# Audio a class directory holds: untrimmed downloads, trimmed windows and augmented copies
+AUDIO_STAGES = ("download", "trimmed", "augmented")
+# The part of it that is not made by augmentation
+SOURCE_STAGES = ("download", "trimmed")
+
+# YouTube video ids have 11 characters; downloads are saved as '<id>.wav', trimmed windows as '<id>_<n>.wav'
+YOUTUBE_ID_LENGTH = 11
+
+# data_aug names augmented copies '<source file>_<augmentation>_<i>.wav'
+AUGMENTATIONS = ("speed", "noise", "pitch", "echo")
+AUGMENTED_NAME = re.compile(rf"^(?P<source>.+)_(?P<augmentation>(?:{'|'.join(AUGMENTATIONS)})_\d+)$")
+
+# Spectrogram images are named '<class, spaces as underscores><n>_spectrogram'
+SPECTROGRAM_NAME = re.compile(r"^(?P<subdirectory>.+?)(?P<index>\d+)_spectrogram$")
+
+# Silence gate verdicts that exclude a file ('unknown' files could not be analysed and are kept)
+GATED = "verdict NOT IN ('ok', 'unknown')"
+
+# Clips whose parent is excluded, e.g. the spectrograms of an excluded class directory (subdirectory 'spectrograms')
+PARENT_EXCLUDED = "EXISTS (SELECT 1 FROM clips AS parent WHERE parent.id = clips.parent_id AND parent.excluded = 1)"
+
+# Clips whose parent's audio the silence gate rejected, e.g. the spectrogram of a silent clip
+PARENT_GATED = ("EXISTS (SELECT 1 FROM files AS parent_file JOIN gate_results ON gate_results.path = parent_file.path"
+                f" WHERE parent_file.clip_id = clips.parent_id AND {GATED})")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS clips (
+    id INTEGER PRIMARY KEY,
+    segment_id TEXT,            -- AudioSet style '<youtube id>_<offset ms>'
+    source_id TEXT,             -- YouTube video ID
+    segment_index INTEGER,      -- n in '<source id>_<n>.wav' written by the trimmer
+    start_ms INTEGER,           -- trim window inside the downloaded segment
+    end_ms INTEGER,
+    main_folder TEXT,
+    subdirectory TEXT,
+    label TEXT,
+    parent_id INTEGER REFERENCES clips(id),   -- clip this one was cut or augmented from
+    augmentation TEXT,
+    split TEXT,                 -- 'train' / 'val' / 'test'
+    excluded INTEGER NOT NULL DEFAULT 0,
+    UNIQUE (main_folder, subdirectory, segment_id, segment_index, augmentation)
+);
+CREATE TABLE IF NOT EXISTS files (
+    clip_id INTEGER NOT NULL REFERENCES clips(id),
+    stage TEXT NOT NULL,        -- 'download', 'trimmed', 'augmented', 'spectrogram', ...
+    path TEXT NOT NULL UNIQUE,
+    content_hash TEXT,
+    size INTEGER,
+    PRIMARY KEY (clip_id, stage)
+);
+-- Content hashes cached by (size, mtime) so unchanged files are never re-read
+CREATE TABLE IF NOT EXISTS file_hashes (
+    path TEXT PRIMARY KEY,
+    size INTEGER,
+    mtime_ns INTEGER,
+    content_hash TEXT
+);
+-- Fingerprint of each pipeline stage's inputs at its last successful run
+CREATE TABLE IF NOT EXISTS stage_runs (
+    stage TEXT PRIMARY KEY,
+    fingerprint TEXT,
+    finished_at REAL
+);
+-- Per-item input hashes for stages that process items incrementally
+CREATE TABLE IF NOT EXISTS stage_items (
+    stage TEXT NOT NULL,
+    item TEXT NOT NULL,
+    content_hash TEXT,
+    PRIMARY KEY (stage, item)
+);
+-- Energy statistics of each WAV from the silence gate; verdict is 'ok', 'unknown' (not analysed) or why the file was gated
+CREATE TABLE IF NOT EXISTS gate_results (
+    path TEXT PRIMARY KEY,
+    content_hash TEXT,
+    params TEXT,                -- analysis parameters the statistics were computed with
+    duration_s REAL,
+    rms_dbfs REAL,
+    peak_dbfs REAL,
+    active_fraction REAL,       -- fraction of probed frames above the silence threshold
+    clipped_fraction REAL,      -- fraction of probed samples at full scale
+    verdict TEXT
+);
+CREATE INDEX IF NOT EXISTS clips_class ON clips (main_folder, subdirectory);
+CREATE INDEX IF NOT EXISTS clips_split ON clips (label, split);
+CREATE INDEX IF NOT EXISTS clips_source ON clips (source_id);
+CREATE INDEX IF NOT EXISTS clips_parent ON clips (parent_id);
+CREATE INDEX IF NOT EXISTS files_stage ON files (stage);
+"""
+
+
+def connect(path=MANIFEST_PATH):
+    """
+    Open (and create if needed) the manifest. Safe to call from every worker
+    process on the node that holds the file; shards on other nodes read a
+    snapshot instead (see sharding.write_inputs), since WAL mode does not work
+    over network filesystems.
+
+    The connection autocommits, so a worker never holds the write lock while it
+    downloads or decodes audio; bulk updates use explicit transactions.
+    """
+    conn = sqlite3.connect(path, timeout=60, isolation_level=None)
+    conn.row_factory = sqlite3.Row
+    # WAL lets worker processes read while one of them writes
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.executescript(SCHEMA)
+    return conn
+
+
+def file_hash(path, chunk_size=1 << 20):
+    """SHA-1 of a file's contents, read in chunks."""
+    h = hashlib.sha1()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def cached_file_hash(conn, path):
+    """Content hash of a file, recomputed only when its size or mtime changed."""
+    st = os.stat(path)
+    row = conn.execute("SELECT size, mtime_ns, content_hash FROM file_hashes WHERE path = ?", (path,)).fetchone()
+    if row and row["size"] == st.st_size and row["mtime_ns"] == st.st_mtime_ns:
+        return row["content_hash"]
+    content_hash = file_hash(path)
+    conn.execute("INSERT OR REPLACE INTO file_hashes (path, size, mtime_ns, content_hash) VALUES (?, ?, ?, ?)",
+                 (path, st.st_size, st.st_mtime_ns, content_hash))
+    return content_hash
+
+
+def hash_cache(conn, extension=""):
+    """{path: [size, mtime_ns, content hash]} of the cached file hashes, for processes that cannot open the manifest."""
+    return {row["path"]: [row["size"], row["mtime_ns"], row["content_hash"]]
+            for row in conn.execute("SELECT * FROM file_hashes WHERE path LIKE ?", (f"%{extension}",))}
+
+
+def snapshot_file_hash(cache, path):
+    """`cached_file_hash` against a `hash_cache` snapshot; new hashes are not stored."""
+    st = os.stat(path)
+    size, mtime_ns, content_hash = cache.get(path, (None, None, None))
+    if size == st.st_size and mtime_ns == st.st_mtime_ns:
+        return content_hash
+    return file_hash(path)
+
+
+def stage_fingerprint(conn, stage):
+    row = conn.execute("SELECT fingerprint FROM stage_runs WHERE stage = ?", (stage,)).fetchone()
+    return row["fingerprint"] if row else None
+
+
+def set_stage_fingerprint(conn, stage, fingerprint):
+    conn.execute("INSERT OR REPLACE INTO stage_runs (stage, fingerprint, finished_at) VALUES (?, ?, ?)",
+                 (stage, fingerprint, time.time()))
+
+
+def stage_item_hashes(conn, stage):
+    """{item: content hash} of the items a stage has already processed."""
+    return {row["item"]: row["content_hash"]
+            for row in conn.execute("SELECT item, content_hash FROM stage_items WHERE stage = ?", (stage,))}
+
+
+def set_stage_items(conn, stage, items):
+    """Record processed items as (item, content hash) pairs."""
+    conn.execute("BEGIN")
+    conn.executemany("INSERT OR REPLACE INTO stage_items (stage, item, content_hash) VALUES (?, ?, ?)",
+                     [(stage, item, content_hash) for item, content_hash in items])
+    conn.execute("COMMIT")
+
+
+def split_class_path(directory, main_folders):
+    """Map a class directory such as '../emergency sounds/Alarm' to ('emergency sounds', 'Alarm')."""
+    for main_folder in main_folders:
+        rel = os.path.relpath(directory, main_folder)
+        if not rel.startswith(".."):
+            return os.path.basename(os.path.normpath(main_folder)), rel
+    raise ValueError(f"{directory} is not inside any of {main_folders}")
+
+
+def add_clip(conn, main_folder, subdirectory, segment_id=None, segment_index=None, start_ms=None, end_ms=None,
+             parent_id=None, augmentation=None, source_id=None):
+    """Insert a clip (or return the existing one) and return its id; source_id defaults to the segment id's video."""
+    # UNIQUE treats NULLs as distinct, so look the clip up with IS before inserting
+    row = conn.execute(
+        "SELECT id FROM clips WHERE main_folder = ? AND subdirectory = ? AND segment_id IS ?"
+        " AND segment_index IS ? AND augmentation IS ? ORDER BY id LIMIT 1",
+        (main_folder, subdirectory, segment_id, segment_index, augmentation),
+    ).fetchone()
+    if row:
+        return row["id"]
+    if source_id is None and segment_id:
+        source_id = segment_id.rsplit('_', 1)[0]
+    cur = conn.execute(
+        "INSERT INTO clips (segment_id, source_id, segment_index, start_ms, end_ms, main_folder,"
+        " subdirectory, label, parent_id, augmentation) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+        (segment_id, source_id, segment_index, start_ms, end_ms, main_folder, subdirectory,
+         LABELS.get(main_folder, main_folder), parent_id, augmentation),
+    )
+    return cur.lastrowid
+
+
+def record_file(conn, clip_id, stage, path, compute_hash=True):
+    """Record (or replace) the file a stage produced for a clip."""
+    conn.execute(
+        "INSERT OR REPLACE INTO files (clip_id, stage, path, content_hash, size) VALUES (?, ?, ?, ?, ?)",
+        (clip_id, stage, path, file_hash(path) if compute_hash else None, os.path.getsize(path)),
+    )
+
+
+def remove_file(conn, path):
+    conn.execute("DELETE FROM files WHERE path = ?", (path,))
+
+
+def stage_file(conn, clip_id, stage):
+    """Path a stage produced for a clip, or None if the stage has not run for it."""
+    row = conn.execute("SELECT path FROM files WHERE clip_id = ? AND stage = ?", (clip_id, stage)).fetchone()
+    return row["path"] if row else None
+
+
+def has_source(conn, main_folder, subdirectory, source_id):
+    """Whether a class directory holds the download of a video or windows trimmed from it."""
+    row = conn.execute(
+        "SELECT 1 FROM clips JOIN files ON files.clip_id = clips.id WHERE clips.main_folder = ?"
+        " AND clips.subdirectory = ? AND clips.source_id = ? AND files.stage IN ('download', 'trimmed') LIMIT 1",
+        (main_folder, subdirectory, source_id),
+    ).fetchone()
+    return row is not None
+
+
+def query_files(conn, stage, label=None, main_folder=None, subdirectory=None, split=None, include_excluded=False):
+    """Rows (clip columns plus path/content_hash) for every file of a stage matching the filters."""
+    sql = "SELECT clips.*, files.path, files.content_hash FROM files JOIN clips ON clips.id = files.clip_id WHERE files.stage = ?"
+    params = [stage]
+    for column, value in (("label", label), ("main_folder", main_folder), ("subdirectory", subdirectory), ("split", split)):
+        if value is not None:
+            sql += f" AND clips.{column} = ?"
+            params.append(value)
+    if not include_excluded:
+        sql += (f" AND clips.excluded = 0 AND NOT {PARENT_EXCLUDED} AND NOT {PARENT_GATED}"
+                f" AND files.path NOT IN (SELECT path FROM gate_results WHERE {GATED})")
+    return conn.execute(sql + " ORDER BY files.path", params).fetchall()
+
+
+def count_files(conn, stage, main_folder=None, subdirectory=None):
+    sql = "SELECT COUNT(*) FROM files JOIN clips ON clips.id = files.clip_id WHERE files.stage = ?"
+    params = [stage]
+    for column, value in (("main_folder", main_folder), ("subdirectory", subdirectory)):
+        if value is not None:
+            sql += f" AND clips.{column} = ?"
+            params.append(value)
+    return conn.execute(sql, params).fetchone()[0]
+
+
+def count_sources(conn, main_folder, subdirectory):
+    """
+    Downloaded source videos of a class directory.
+
+    A source counts while its download file exists and, after the trimmer has
+    deleted that file, through the trimmed windows cut from it.
+    """
+    return conn.execute(
+        "SELECT COUNT(DISTINCT clips.source_id) FROM clips JOIN files ON files.clip_id = clips.id"
+        " WHERE clips.main_folder = ? AND clips.subdirectory = ? AND files.stage IN ('download', 'trimmed')",
+        (main_folder, subdirectory),
+    ).fetchone()[0]
+
+
+def count_by_directory(conn, stages):
+    """(main_folder, subdirectory, file count) for every class directory, counting files of the given stages."""
+    placeholders = ",".join("?" * len(stages))
+    return conn.execute(
+        "SELECT clips.main_folder, clips.subdirectory, COUNT(*) AS file_count FROM files"
+        f" JOIN clips ON clips.id = files.clip_id WHERE files.stage IN ({placeholders})"
+        " GROUP BY clips.main_folder, clips.subdirectory ORDER BY clips.main_folder, clips.subdirectory",
+        list(stages),
+    ).fetchall()
+
+
+def record_augmented(conn, main_folder, subdirectory, outputs):
+    """
+    Register augmented files of a class directory in one transaction.
+
+    outputs are (source path, output path, augmentation) tuples; each output
+    becomes a clip derived from the source's clip. Contents are not hashed
+    here, the stages reading the files hash them on demand.
+    """
+    conn.execute("BEGIN")
+    for source, output, augmentation in outputs:
+        row = conn.execute("SELECT clips.id, clips.source_id FROM files JOIN clips ON clips.id = files.clip_id"
+                           " WHERE files.path = ?", (source,)).fetchone()
+        base = os.path.splitext(os.path.basename(source))[0]
+        clip_id = add_clip(conn, main_folder, subdirectory, segment_id=base, parent_id=row["id"] if row else None,
+                           augmentation=augmentation, source_id=row["source_id"] if row else source_of_name(base))
+        record_file(conn, clip_id, "augmented", output, compute_hash=False)
+    conn.execute("COMMIT")
+
+
+def source_of_name(base):
+    """Video id of a class directory WAV from its base name (see import_class_directory)."""
+    match = AUGMENTED_NAME.match(base)
+    while match:
+        base = match["source"]
+        match = AUGMENTED_NAME.match(base)
+    return base if len(base) <= YOUTUBE_ID_LENGTH else base.rsplit('_', 1)[0]
+
+
+def import_class_directory(conn, directory, main_folder, subdirectory):
+    """
+    Register the WAVs of a class directory that are not in the manifest yet.
+
+    Files written before the manifest existed are recognised by name:
+    '<id>.wav' downloads, '<id>_<n>.wav' trimmed windows and
+    '<source>_<augmentation>_<i>.wav' augmented copies, which are linked to
+    their source file's clip. Contents are not hashed here. Returns the
+    number of newly registered files.
+    """
+    known = {row["path"] for row in conn.execute("SELECT path FROM files WHERE path LIKE ?",
+                                                 (os.path.join(directory, "%"),))}
+    # Sources sort before the copies made from them
+    names = sorted((f for f in os.listdir(directory) if f.endswith(".wav")), key=lambda f: (len(f), f))
+    added = 0
+    conn.execute("BEGIN")
+    for name in names:
+        path = os.path.join(directory, name)
+        if path in known:
+            continue
+        base = os.path.splitext(name)[0]
+        match = AUGMENTED_NAME.match(base)
+        if match:
+            row = conn.execute("SELECT clip_id FROM files WHERE path = ?",
+                               (os.path.join(directory, match["source"] + ".wav"),)).fetchone()
+            clip_id = add_clip(conn, main_folder, subdirectory, segment_id=match["source"],
+                               parent_id=row["clip_id"] if row else None, augmentation=match["augmentation"],
+                               source_id=source_of_name(base))
+            stage = "augmented"
+        elif len(base) <= YOUTUBE_ID_LENGTH:
+            clip_id = add_clip(conn, main_folder, subdirectory, segment_id=base, source_id=base)
+            stage = "download"
+        else:
+            clip_id = add_clip(conn, main_folder, subdirectory, segment_id=base, source_id=source_of_name(base))
+            stage = "trimmed"
+        record_file(conn, clip_id, stage, path, compute_hash=False)
+        added += 1
+    conn.execute("COMMIT")
+    return added
+
+
+def gate_results(conn):
+    """{path: row} of every file the silence gate has analysed."""
+    return {row["path"]: row for row in conn.execute("SELECT * FROM gate_results")}
+
+
+def record_gate_results(conn, results):
+    """Store silence gate results, given as dicts with the gate_results columns."""
+    conn.execute("BEGIN")
+    conn.executemany(
+        "INSERT OR REPLACE INTO gate_results (path, content_hash, params, duration_s, rms_dbfs, peak_dbfs,"
+        " active_fraction, clipped_fraction, verdict) VALUES (:path, :content_hash, :params, :duration_s, :rms_dbfs,"
+        " :peak_dbfs, :active_fraction, :clipped_fraction, :verdict)",
+        results,
+    )
+    conn.execute("COMMIT")
+
+
+def gated_paths(conn):
+    """Paths the silence gate rejected; the heavy stages skip these."""
+    return {row["path"] for row in conn.execute(f"SELECT path FROM gate_results WHERE {GATED}")}
+
+
+def exclude_subdirectories(conn, subdirectories):
+    """Mark every clip of the given class directories as excluded from training."""
+    placeholders = ",".join("?" * len(subdirectories))
+    cur = conn.execute(f"UPDATE clips SET excluded = 1 WHERE subdirectory IN ({placeholders})", list(subdirectories))
+    return cur.rowcount
+
+
+def import_directory(conn, directory, stage, main_folder, subdirectory, extension, compute_hash=True):
+    """
+    Register files of a directory that are not in the manifest yet.
+
+    Used to bootstrap the manifest from an existing tree and by stages whose
+    outputs cannot be traced back to a source segment (e.g. spectrogram folders,
+    which `link_spectrograms` links afterwards).
+    Returns the number of newly registered files.
+    """
+    known = {row["path"] for row in conn.execute("SELECT path FROM files WHERE stage = ?", (stage,))}
+    added = 0
+    conn.execute("BEGIN")
+    for file in sorted(os.listdir(directory)):
+        path = os.path.join(directory, file)
+        if not file.endswith(extension) or path in known:
+            continue
+        # The file's base name stands in for the segment id (e.g. '<source id>_<n>' for trimmed clips)
+        base = os.path.splitext(file)[0]
+        clip_id = add_clip(conn, main_folder, subdirectory, segment_id=base)
+        record_file(conn, clip_id, stage, path, compute_hash)
+        added += 1
+    conn.execute("COMMIT")
+    return added
+
+
+def link_spectrograms(conn, main_folders, stage="spectrogram"):
+    """
+    Point each spectrogram's clip at the audio clip it was rendered from (clips.parent_id).
+
+    The images were rendered per class directory in listing order (Windows
+    lists case-insensitively), so '<class><n>_spectrogram' is the n-th WAV of
+    that class directory, counting from 1. The n-th file is taken from the
+    directory as it is on disk, registering WAVs the manifest does not know
+    yet. A class whose WAV count differs from its highest spectrogram index
+    no longer holds the files it was rendered from and is not linked.
+
+    Returns (number of spectrograms linked, {(main folder, subdirectory):
+    (WAV files, highest spectrogram index)} of the classes left unlinked).
+    """
+    roots = {os.path.basename(os.path.normpath(folder)): folder for folder in main_folders}
+    spectrograms = {}
+    for row in conn.execute(
+            "SELECT clips.id, clips.main_folder, clips.segment_id, clips.parent_id FROM clips"
+            " JOIN files ON files.clip_id = clips.id WHERE files.stage = ?", (stage,)):
+        match = SPECTROGRAM_NAME.match(row["segment_id"] or "")
+        if match and int(match["index"]) > 0:
+            key = (row["main_folder"], match["subdirectory"].replace("_", " "))
+            spectrograms.setdefault(key, []).append((int(match["index"]), row["id"], row["parent_id"]))
+    updates = []
+    mismatched = {}
+    for (main_folder, subdirectory), rows in spectrograms.items():
+        if all(parent_id is not None for _, _, parent_id in rows):
+            continue
+        directory = os.path.join(roots.get(main_folder, main_folder), subdirectory)
+        names = sorted((f for f in os.listdir(directory) if f.endswith(".wav")), key=str.upper) \
+            if os.path.isdir(directory) else []
+        highest = max(index for index, _, _ in rows)
+        if len(names) != highest:
+            mismatched[(main_folder, subdirectory)] = (len(names), highest)
+            continue
+        import_class_directory(conn, directory, main_folder, subdirectory)
+        clip_ids = {row["path"]: row["clip_id"] for row in conn.execute(
+            "SELECT path, clip_id FROM files WHERE path LIKE ?", (os.path.join(directory, "%"),))}
+        updates.extend((clip_ids[os.path.join(directory, names[index - 1])], clip_id)
+                       for index, clip_id, parent_id in rows if parent_id is None)
+    conn.execute("BEGIN")
+    conn.executemany("UPDATE clips SET parent_id = ? WHERE id = ?", updates)
+    conn.execute("COMMIT")
+    return len(updates), mismatched
+
+
+def spectrogram_sources(conn, stage="spectrogram"):
+    """{spectrogram path: (main folder, subdirectory, audio file name, source id)} of linked spectrograms."""
+    placeholders = ",".join("?" * len(AUDIO_STAGES))
+    rows = conn.execute(
+        "SELECT spectrogram.path AS spectrogram, audio.path AS audio, source.main_folder, source.subdirectory,"
+        " source.source_id FROM files AS spectrogram"
+        " JOIN clips ON clips.id = spectrogram.clip_id"
+        " JOIN clips AS source ON source.id = clips.parent_id"
+        f" JOIN files AS audio ON audio.clip_id = source.id AND audio.stage IN ({placeholders})"
+        " WHERE spectrogram.stage = ?", (*AUDIO_STAGES, stage))
+    return {row["spectrogram"]: (row["main_folder"], row["subdirectory"], os.path.basename(row["audio"]),
+                                 row["source_id"]) for row in rows}
+
+
+def audio_sources(conn):
+    """{(main folder, subdirectory, file name): source id} of every audio clip, the key of a features CSV row."""
+    placeholders = ",".join("?" * len(AUDIO_STAGES))
+    rows = conn.execute(
+        "SELECT clips.main_folder, clips.subdirectory, clips.source_id, files.path FROM clips"
+        f" JOIN files ON files.clip_id = clips.id WHERE files.stage IN ({placeholders})", AUDIO_STAGES)
+    return {(row["main_folder"], row["subdirectory"], os.path.basename(row["path"])): row["source_id"] for row in rows}
+
+
+def assign_splits(conn, stage, test_size=0.2, val_fraction=0.5, seed=42):
+    """
+    Stratified train/val/test assignment for clips of a stage that have no split yet.
+
+    test_size of each label is held out and val_fraction of the held-out part
+    becomes validation, matching the two train_test_split calls cnn.py used.
+    Existing assignments are kept, so splits stay stable as the dataset grows.
+    """
+    rng = random.Random(seed)
+    updates = []
+    labels = [row["label"] for row in conn.execute("SELECT DISTINCT label FROM clips")]
+    for label in labels:
+        ids = [row["id"] for row in conn.execute(
+            "SELECT clips.id FROM clips JOIN files ON files.clip_id = clips.id WHERE files.stage = ? AND clips.label = ?"
+            f" AND clips.split IS NULL AND clips.excluded = 0 AND NOT {PARENT_EXCLUDED} AND NOT {PARENT_GATED}"
+            f" AND files.path NOT IN (SELECT path FROM gate_results WHERE {GATED}) ORDER BY clips.id",
+            (stage, label))]
+        rng.shuffle(ids)
+        n_held_out = int(round(len(ids) * test_size))
+        n_val = int(round(n_held_out * val_fraction))
+        for i, clip_id in enumerate(ids):
+            split = "val" if i < n_val else "test" if i < n_held_out else "train"
+            updates.append((split, clip_id))
+    conn.execute("BEGIN")
+    conn.executemany("UPDATE clips SET split = ? WHERE id = ?", updates)
+    conn.execute("COMMIT")
+    return len(updates)
+
+
+def labels_frame(conn, stage, label=None, split=None):
+    """file_path/label DataFrame in the format of the *_labels.csv files."""
+    import pandas as pd
+    rows = query_files(conn, stage, label=label, split=split)
+    return pd.DataFrame({"file_path": [r["path"] for r in rows], "label": [r["label"] for r in rows]})
+
+
+def export_labels_csv(conn, stage, output_csv, label=None, split=None):
+    df = labels_frame(conn, stage, label=label, split=split)
+    df.to_csv(output_csv, index=False)
+    return df
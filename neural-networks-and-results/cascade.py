@@ -0,0 +1,335 @@
+import os
+import sys
+import json
+import argparse
+import numpy as np
+import pandas as pd
+
+from prototype_index import FEATURE_COLUMNS, default_model_path
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import manifest
+from pipeline_config import config
+from pipeline_metrics import StageMetrics, METRICS_DIR
+
+results_dir = config["results_dir"]
+default_forest_path = os.path.join(results_dir, "feature_forest.npz")
+default_test_csv = os.path.join(results_dir, "test_labels.csv")
+
+# Columns identifying the clip of a features CSV row
+KEY_COLUMNS = ["Main_Folder", "Subdirectory", "File"]
+
+# Batch size from which sklearn's predict_proba beats the compiled walk (measured crossover of 100 trees)
+SKLEARN_BATCH_ROWS = 256
+
+
+class CompiledForest:
+    """
+    A trained RandomForestClassifier flattened into numpy arrays.
+
+    All trees are packed into one node table (split feature, threshold, child
+    indices, probability of the positive class at each node), so scoring a
+    batch walks every tree for every clip in max-depth vectorised steps with no
+    Python-level tree objects or sklearn. That is the faster path for single
+    clips and small batches; batches of SKLEARN_BATCH_ROWS or more go to the
+    sklearn forest, saved next to the node table, when it is available.
+
+    Args:
+    - feature, threshold, left, right, value: Per-node arrays; left/right are
+      -1 at leaves.
+    - roots: Index of each tree's root node.
+    - depth: Maximum depth over all trees.
+    - fill: Per-feature values substituted for missing (NaN) inputs.
+    - forest, positive: The sklearn forest and the column of the positive
+      class in its predict_proba output, or None.
+    """
+
+    def __init__(self, feature, threshold, left, right, value, roots, depth, fill, forest=None, positive=None):
+        self.feature = feature
+        self.threshold = threshold
+        self.left = left
+        self.right = right
+        self.value = value
+        self.roots = roots
+        self.depth = int(depth)
+        self.fill = fill
+        self.forest = forest
+        self.positive = positive
+
+    @classmethod
+    def from_sklearn(cls, forest, positive_class, fill):
+        positive = list(forest.classes_).index(positive_class)
+        parts = {"feature": [], "threshold": [], "left": [], "right": [], "value": []}
+        roots, offset, depth = [], 0, 0
+        for estimator in forest.estimators_:
+            tree = estimator.tree_
+            is_leaf = tree.children_left < 0
+            counts = tree.value[:, 0, :]
+            roots.append(offset)
+            parts["feature"].append(np.where(is_leaf, 0, tree.feature))
+            parts["threshold"].append(tree.threshold)
+            parts["left"].append(np.where(is_leaf, -1, tree.children_left + offset))
+            parts["right"].append(np.where(is_leaf, -1, tree.children_right + offset))
+            parts["value"].append(counts[:, positive] / counts.sum(axis=1))
+            offset += tree.node_count
+            depth = max(depth, tree.max_depth)
+        arrays = {name: np.concatenate(values) for name, values in parts.items()}
+        return cls(arrays["feature"].astype(np.int32), arrays["threshold"].astype(np.float64),
+                   arrays["left"].astype(np.int64), arrays["right"].astype(np.int64),
+                   arrays["value"].astype(np.float32), np.asarray(roots, dtype=np.int64), depth,
+                   np.asarray(fill, dtype=np.float64), forest, positive)
+
+    def predict_proba(self, X):
+        """Probability of the positive class for each row of X."""
+        X = np.asarray(X, dtype=np.float64)
+        X = np.where(np.isnan(X), self.fill, X)
+        if self.forest is not None and len(X) >= SKLEARN_BATCH_ROWS:
+            return self.forest.predict_proba(X)[:, self.positive].astype(np.float32)
+        n_trees = len(self.roots)
+        # One (tree, clip) walker per pair, starting at the tree roots
+        node = np.repeat(self.roots, len(X))
+        rows = np.tile(np.arange(len(X)), n_trees)
+        active = np.flatnonzero(self.left[node] >= 0)
+        # Only walkers that have not reached a leaf take another step
+        while active.size:
+            current = node[active]
+            go_left = X[rows[active], self.feature[current]] <= self.threshold[current]
+            nxt = np.where(go_left, self.left[current], self.right[current])
+            node[active] = nxt
+            active = active[self.left[nxt] >= 0]
+        return self.value[node].reshape(n_trees, len(X)).mean(axis=0)
+
+    @staticmethod
+    def forest_path(path):
+        return os.path.splitext(path)[0] + ".joblib"
+
+    def save(self, path):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        np.savez(path, feature=self.feature, threshold=self.threshold, left=self.left, right=self.right,
+                 value=self.value, roots=self.roots, depth=self.depth, fill=self.fill)
+        if self.forest is not None:
+            import joblib
+            joblib.dump((self.forest, self.positive), self.forest_path(path))
+
+    @classmethod
+    def load(cls, path):
+        """Load a saved forest; without its .joblib file (or sklearn) every batch takes the compiled path."""
+        forest = positive = None
+        if os.path.exists(cls.forest_path(path)):
+            try:
+                import joblib
+                forest, positive = joblib.load(cls.forest_path(path))
+            except ImportError:
+                pass
+        with np.load(path) as data:
+            return cls(data["feature"], data["threshold"], data["left"], data["right"], data["value"],
+                       data["roots"], data["depth"], data["fill"], forest, positive)
+
+
+def feature_matrix(df):
+    """The extract_features columns as floats; Tempo may be stored as a one-element list such as '[117.45]'."""
+    columns = []
+    for c in FEATURE_COLUMNS:
+        values = df[c] if pd.api.types.is_numeric_dtype(df[c]) else df[c].astype(str).str.strip("[]")
+        columns.append(pd.to_numeric(values, errors="coerce"))
+    return np.column_stack(columns).astype(np.float64)
+
+
+def join_features(test, features, sources):
+    """
+    Feature vector for every test row (NaN rows where the clip has no extracted features).
+
+    A spectrogram reaches its features row through the audio clip the
+    manifest links it to (see manifest.link_spectrograms).
+    """
+    features = features.drop_duplicates(KEY_COLUMNS).set_index(KEY_COLUMNS)
+    X = np.full((len(test), len(FEATURE_COLUMNS)), np.nan)
+    keys = [sources[path][:3] if path in sources else None for path in test["file_path"]]
+    found = np.array([key is not None and key in features.index for key in keys], dtype=bool)
+    if found.any():
+        X[found] = feature_matrix(features.loc[[key for key, ok in zip(keys, found) if ok]])
+    return X, found
+
+
+def load_features(features_csv):
+    features = pd.read_csv(features_csv)
+    features["label"] = features["Main_Folder"].map(manifest.LABELS)
+    return features
+
+
+def train(features_csv, test_csv, output_path, n_estimators=100):
+    """
+    Fit the tabular model on clips outside the test split and save it compiled.
+
+    Every clip of a source video with a clip in the test split is held out,
+    which covers the test clips' augmentations and the other windows of the
+    same recording. A RandomForestClassifier, as in the analysis notebook,
+    predicting the probability that a clip is an emergency sound.
+
+    Returns None if none of the test spectrograms is linked to a clip.
+    """
+    from sklearn.ensemble import RandomForestClassifier
+    conn = manifest.connect()
+    sources = manifest.spectrogram_sources(conn)
+    test_paths = pd.read_csv(test_csv)["file_path"]
+    test_sources = {sources[path][3] for path in test_paths if path in sources} - {None}
+    if not test_sources:
+        print(f"None of the {len(test_paths)} test spectrograms is linked to an audio clip in the manifest; "
+              f"run spectrogram_to_csv/code.py first.")
+        return None
+
+    features = load_features(features_csv)
+    audio = manifest.audio_sources(conn)
+    source_ids = [audio.get(key) for key in features[KEY_COLUMNS].itertuples(index=False, name=None)]
+    # Rows the manifest does not know cannot be checked against the test split
+    usable = np.array([s is not None and s not in test_sources for s in source_ids], dtype=bool)
+    train_rows = features[usable & features["label"].notna().to_numpy()]
+    print(f"Held out {sum(s in test_sources for s in source_ids)} clips of {len(test_sources)} test sources; "
+          f"skipped {source_ids.count(None)} clips missing from the manifest")
+    X = feature_matrix(train_rows)
+    fill = np.nanmean(X, axis=0)
+    X = np.where(np.isnan(X), fill, X)
+
+    forest = RandomForestClassifier(n_estimators=n_estimators, random_state=42, n_jobs=-1)
+    forest.fit(X, train_rows["label"])
+    compiled = CompiledForest.from_sklearn(forest, "emergency", fill)
+    compiled.save(output_path)
+    print(f"Trained on {len(train_rows)} clips ({n_estimators} trees, depth {compiled.depth}); saved to {output_path}")
+
+    return compiled
+
+
+def feature_seconds_per_clip():
+    """Mean extraction time per clip from the features stage's last metrics file, or None."""
+    path = os.path.join(METRICS_DIR, "features.json")
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return json.load(f).get("latency_mean_s")
+
+
+def cnn_predict(model, file_paths, batch_size=32):
+    """CNN emergency probabilities with the same image pipeline as cnn.py."""
+    from tensorflow.keras.preprocessing.image import ImageDataGenerator
+    if len(file_paths) == 0:
+        return np.empty(0, dtype=np.float32)
+    generator = ImageDataGenerator(rescale=1./255).flow_from_dataframe(
+        pd.DataFrame({"file_path": list(file_paths)}),
+        x_col="file_path",
+        target_size=(224, 224),
+        class_mode=None,
+        batch_size=batch_size,
+        shuffle=False,
+    )
+    return model.predict(generator, verbose=0).flatten()
+
+
+def evaluate(test_csv, features_csv, forest_path, model_path, low=0.2, high=0.8):
+    """
+    Run the cascade on test_labels.csv next to the CNN alone.
+
+    Clips whose tabular probability is at most `low` or at least `high` are
+    decided by the tabular model; the rest (and clips without extracted
+    features) go to the CNN.
+
+    The cascade's clips/s leave out feature extraction, which the pipeline's
+    features stage pays anyway; cascade_clips_per_sec_with_features adds its
+    mean per-clip cost from the features metrics.
+    """
+    import tensorflow as tf
+    metrics = StageMetrics("cascade")
+    test = pd.read_csv(test_csv)
+    y_true = test["label"].map({"normal": 0, "emergency": 1}).to_numpy()
+    forest = CompiledForest.load(forest_path)
+    model = tf.keras.models.load_model(model_path)
+    X, found = join_features(test, load_features(features_csv), manifest.spectrogram_sources(manifest.connect()))
+
+    # Warm-up so neither timed phase pays for the first predict (graph tracing, lazy allocation)
+    cnn_predict(model, test["file_path"].iloc[:1])
+    forest.predict_proba(X[:1])
+
+    # Baseline: every clip through the CNN
+    with metrics.phase("cnn_only"):
+        cnn_prob = cnn_predict(model, test["file_path"])
+
+    # Cascade: tabular model first, CNN only for the uncertain band
+    with metrics.phase("cascade"):
+        with metrics.phase("tabular"):
+            tab_prob = np.full(len(test), 0.5, dtype=np.float32)
+            tab_prob[found] = forest.predict_proba(X[found])
+            confident = found & ((tab_prob <= low) | (tab_prob >= high))
+        with metrics.phase("cascade_cnn"):
+            uncertain = np.flatnonzero(~confident)
+            cascade_prob = tab_prob.copy()
+            cascade_prob[uncertain] = cnn_predict(model, test["file_path"].iloc[uncertain])
+
+    cnn_accuracy = float(np.mean((cnn_prob > 0.5) == y_true))
+    cascade_accuracy = float(np.mean((cascade_prob > 0.5) == y_true))
+    n = len(test)
+    feature_s = feature_seconds_per_clip()
+    report = {
+        "test_clips": n,
+        "band": [low, high],
+        "clips_without_features": int(n - found.sum()),
+        "cnn_calls": int(len(uncertain)),
+        "cnn_calls_avoided_fraction": float(confident.sum() / n) if n else 0.0,
+        "tabular_decided_accuracy": float(np.mean((tab_prob[confident] > 0.5) == y_true[confident])) if confident.any() else None,
+        "cnn_only_accuracy": cnn_accuracy,
+        "cascade_accuracy": cascade_accuracy,
+        "accuracy_change": cascade_accuracy - cnn_accuracy,
+        "cnn_only_clips_per_sec": n / metrics.phases["cnn_only"] if metrics.phases["cnn_only"] else None,
+        "cascade_clips_per_sec": n / metrics.phases["cascade"] if metrics.phases["cascade"] else None,
+        "tabular_batch_clips": int(found.sum()),
+        "feature_extraction_s_per_clip": feature_s,
+        "cascade_clips_per_sec_with_features": (
+            float(n / (metrics.phases["cascade"] + found.sum() * feature_s)) if feature_s is not None else None),
+        "notes": [
+            "cascade_clips_per_sec excludes feature extraction; cascade_clips_per_sec_with_features adds "
+            "the features stage's mean per-clip time.",
+        ],
+    }
+    report["phases_s"] = metrics.phases
+    report_path = os.path.join(results_dir, "cascade_report.json")
+    with open(report_path, "w") as f:
+        json.dump(report, f, indent=2)
+
+    print(f"Clips with features: {found.sum()}/{n}")
+    print(f"CNN calls avoided: {report['cnn_calls_avoided_fraction']:.1%} ({n - report['cnn_calls']}/{n} clips)")
+    print(f"Accuracy: CNN only {cnn_accuracy:.4f}, cascade {cascade_accuracy:.4f} ({report['accuracy_change']:+.4f})")
+    print(f"Throughput: CNN only {report['cnn_only_clips_per_sec']:.1f} clips/s, "
+          f"cascade {report['cascade_clips_per_sec']:.1f} clips/s (excluding feature extraction)"
+          + (f", {report['cascade_clips_per_sec_with_features']:.1f} clips/s including it" if feature_s is not None else ""))
+    print(f"Report saved to {report_path}")
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Cascade inference: tabular model on extracted features gating the CNN.")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    train_parser = sub.add_parser("train", help="Fit and compile the tabular model.")
+    train_parser.add_argument("--features-csv", default=config["features_csv"])
+    train_parser.add_argument("--test-csv", default=default_test_csv, help="Clips held out from training.")
+    train_parser.add_argument("--output", default=default_forest_path)
+    train_parser.add_argument("--trees", type=int, default=100)
+
+    eval_parser = sub.add_parser("evaluate", help="Compare the cascade with the CNN alone on the test split.")
+    eval_parser.add_argument("--test-csv", default=default_test_csv)
+    eval_parser.add_argument("--features-csv", default=config["features_csv"])
+    eval_parser.add_argument("--forest", default=default_forest_path)
+    eval_parser.add_argument("--model", default=default_model_path)
+    eval_parser.add_argument("--low", type=float, default=0.2, help="Tabular probability at or below which a clip is normal.")
+    eval_parser.add_argument("--high", type=float, default=0.8, help="Tabular probability at or above which a clip is an emergency.")
+
+    args = parser.parse_args()
+    if args.command == "train":
+        if train(args.features_csv, args.test_csv, args.output, args.trees) is None:
+            sys.exit(1)
+    else:
+        if not 0.0 <= args.low <= args.high <= 1.0:
+            parser.error("Need 0 <= --low <= --high <= 1.")
+        evaluate(args.test_csv, args.features_csv, args.forest, args.model, args.low, args.high)
+
+
+if __name__ == "__main__":
+    main()
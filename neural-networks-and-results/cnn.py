@@ -1,11 +1,21 @@
 import os
+import sys
+import time
 import tensorflow as tf
-import pandas as pd
 from tensorflow.keras.preprocessing.image import ImageDataGenerator
-from sklearn.model_selection import train_test_split
 from sklearn.metrics import classification_report, roc_curve, auc, precision_recall_fscore_support, accuracy_score
 import matplotlib.pyplot as plt
 from PIL import Image
+from training_profiler import TrainingProfiler, profiling_enabled
+
+# The dataset manifest lives at the repository root
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import manifest
+from pipeline_config import config
+from pipeline_metrics import StageMetrics
+
+# Stage metrics: per-image verification latency plus wall time of each phase
+metrics = StageMetrics("cnn")
 
 # Check for GPU availability
 print("Checking for GPU...")
@@ -17,10 +27,8 @@ if gpus:
 else:
     print("No GPU available. Using CPU.")
 
-# Paths for spectrograms
-emergency_dir = "/mnt/c/Users/jayant-few-shot/Few_shot/new-sounds/emergency-sounds/emergency_spectrograms"
-normal_dir = "/mnt/c/Users/jayant-few-shot/Few_shot/new-sounds/normal-sounds/spectogram_normal_sounds"
-results_dir = "/mnt/c/Users/jayant-few-shot/Few_shot/neural-networks-and-results"
+# Results directory from the pipeline configuration
+results_dir = config["results_dir"]
 
 # Ensure results directory exists
 if not os.path.exists(results_dir):
@@ -30,45 +38,45 @@ if not os.path.exists(results_dir):
 emergency_csv = "emergency_sounds_labels.csv"
 normal_csv = "normal_sounds_labels.csv"
 
+# Spectrograms are registered in the dataset manifest by spectrogram_to_csv/code.py
+conn = manifest.connect()
+
 # Function to verify and fix images
-def verify_and_fix_images(directory):
-    for file in os.listdir(directory):
-        if file.endswith(".png"):
-            file_path = os.path.join(directory, file)
-            try:
-                with Image.open(file_path) as img:
-                    img.verify()  # Check for issues
-            except (IOError, SyntaxError):
-                print(f"Corrupted file detected and removed: {file_path}")
-                os.remove(file_path)
-
-# Verify and fix images in both directories
-verify_and_fix_images(emergency_dir)
-verify_and_fix_images(normal_dir)
+def verify_and_fix_images(conn, label):
+    for row in manifest.query_files(conn, "spectrogram", label=label):
+        file_path = row["path"]
+        start = time.perf_counter()
+        try:
+            with Image.open(file_path) as img:
+                img.verify()  # Check for issues
+            metrics.item(time.perf_counter() - start)
+        except (IOError, SyntaxError):
+            print(f"Corrupted file detected and removed: {file_path}")
+            os.remove(file_path)
+            manifest.remove_file(conn, file_path)
+            metrics.item(time.perf_counter() - start, ok=False)
+        metrics.report()
+
+# Verify and fix images of both classes
+with metrics.phase("verify"):
+    verify_and_fix_images(conn, "emergency")
+    verify_and_fix_images(conn, "normal")
+metrics.report(force=True)
 
 # Function to generate CSV
-def generate_csv(directory, label, output_csv):
-    data = []
-    for file in os.listdir(directory):
-        if file.endswith(".png"):  # Ensure it's a spectrogram image file
-            file_path = os.path.join(directory, file)
-            data.append({"file_path": file_path, "label": label})
-    df = pd.DataFrame(data)
-    df.to_csv(output_csv, index=False)
+def generate_csv(conn, label, output_csv):
+    manifest.export_labels_csv(conn, "spectrogram", output_csv, label=label)
     print(f"CSV file created: {output_csv}")
 
 # Generate CSV files for emergency and normal sounds
-generate_csv(emergency_dir, "emergency", emergency_csv)
-generate_csv(normal_dir, "normal", normal_csv)
-
-# Load and combine datasets
-emergency_df = pd.read_csv(emergency_csv)
-normal_df = pd.read_csv(normal_csv)
-full_df = pd.concat([emergency_df, normal_df], ignore_index=True)
+generate_csv(conn, "emergency", emergency_csv)
+generate_csv(conn, "normal", normal_csv)
 
-# Split dataset into train, validation, and test sets
-train, test = train_test_split(full_df, test_size=0.2, stratify=full_df['label'], random_state=42)
-val, test = train_test_split(test, test_size=0.5, stratify=test['label'], random_state=42)
+# Stratified train/val/test assignment is stored in the manifest; only new clips get a split
+manifest.assign_splits(conn, "spectrogram", test_size=0.2, val_fraction=0.5, seed=42)
+train = manifest.labels_frame(conn, "spectrogram", split="train")
+val = manifest.labels_frame(conn, "spectrogram", split="val")
+test = manifest.labels_frame(conn, "spectrogram", split="test")
 
 # Save splits to CSV files
 train.to_csv("train_labels.csv", index=False)
@@ -133,20 +141,35 @@ with open(os.path.join(results_dir, "model_summary.txt"), "w") as f:
 
 print("Model summary saved to model_summary.txt")
 
+# Opt-in step-time instrumentation (PROFILE_TRAINING=1); the profiler times the generator's batch fetches
+callbacks = []
+train_data = train_generator
+if profiling_enabled():
+    profiler = TrainingProfiler(results_dir, batch_size=train_generator.batch_size, prefix="cnn")
+    callbacks.append(profiler)
+    train_data = profiler.wrap(train_generator)
+
 # Train the model
-history = model.fit(
-    train_generator,
-    validation_data=val_generator,
-    epochs=10
-)
+with metrics.phase("train"):
+    history = model.fit(
+        train_data,
+        validation_data=val_generator,
+        epochs=10,
+        callbacks=callbacks
+    )
+
+# Save the trained model (used by prototype_index.py for few-shot embeddings)
+model.save(os.path.join(results_dir, "cnn_model.keras"))
 
 # Evaluate the model on the test set
-test_loss, test_accuracy = model.evaluate(test_generator)
+with metrics.phase("evaluate"):
+    test_loss, test_accuracy = model.evaluate(test_generator)
 print(f"Test Loss: {test_loss:.4f}, Test Accuracy: {test_accuracy:.4f}")
 
 # Predictions and labels
 y_true = test["label"].map({"normal": 0, "emergency": 1}).values
-y_pred_prob = model.predict(test_generator).flatten()
+with metrics.phase("predict"):
+    y_pred_prob = model.predict(test_generator).flatten()
 y_pred = (y_pred_prob > 0.5).astype("int32")
 
 
@@ -158,4 +181,7 @@ print(class_report)
 with open(os.path.join(results_dir, "classification_report.txt"), "w") as f:
     f.write(class_report)
 
+metrics.counters["test_samples"] = len(test)
+metrics.write_json(os.path.join(results_dir, "cnn_metrics.json"))
+
 print("Metrics and visualizations saved!")
@@ -0,0 +1,274 @@
+import os
+import sys
+import json
+import time
+import argparse
+import numpy as np
+
+# Column order of the 39-dim feature vector produced by extract_features
+FEATURE_COLUMNS = (
+    [f'MFCC_{i}' for i in range(1, 14)]
+    + [f'Chroma_{i}' for i in range(1, 13)]
+    + [f'Spectral_Contrast_{i}' for i in range(1, 8)]
+    + ['Spectral_Centroid', 'Spectral_Bandwidth', 'Spectral_Rolloff', 'Zero_Crossing_Rate', 'RMS', 'Tempo', 'Pitch']
+)
+
+# The pipeline configuration lives at the repository root
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from pipeline_config import config
+
+# Default location of the trained CNN saved by cnn.py
+default_model_path = os.path.join(config["results_dir"], "cnn_model.keras")
+
+
+def l2_normalize(x):
+    """Scale each row to unit length so dot products are cosine similarities."""
+    norms = np.linalg.norm(x, axis=1, keepdims=True)
+    return x / np.maximum(norms, 1e-12)
+
+
+class PrototypeIndex:
+    """
+    Few-shot class index over fixed-size audio embeddings.
+
+    Every registered class keeps its support embeddings and a prototype (the
+    normalised mean of its supports). Queries are answered with one matrix
+    product against either the prototypes or all supports (k-nearest neighbours),
+    so a new class can be added from a handful of clips without retraining.
+
+    Args:
+    - dim: Embedding dimensionality (128 for the CNN, 39 for extract_features).
+    - embedding: Name of the embedding the index was built from ('cnn' or 'features').
+    - mean, std: Optional per-dimension statistics used to standardise embeddings
+      before normalisation (needed for the feature vector, whose columns differ in scale).
+    """
+
+    def __init__(self, dim, embedding="cnn", mean=None, std=None):
+        self.dim = dim
+        self.embedding = embedding
+        self.mean = None if mean is None else np.asarray(mean, dtype=np.float32)
+        self.std = None if std is None else np.asarray(std, dtype=np.float32)
+        self.class_names = []
+        self.supports = np.empty((0, dim), dtype=np.float32)
+        self.support_labels = np.empty((0,), dtype=np.int32)
+        self.prototypes = np.empty((0, dim), dtype=np.float32)
+
+    def _prepare(self, embeddings):
+        x = np.asarray(embeddings, dtype=np.float32).reshape(-1, self.dim)
+        if self.mean is not None:
+            x = (x - self.mean) / np.maximum(self.std, 1e-12)
+        return l2_normalize(x)
+
+    def add_class(self, name, embeddings):
+        """Register (or extend) a class from its example embeddings."""
+        x = self._prepare(embeddings)
+        if not self.prototypes.flags.writeable:
+            # Loaded read-only from a memory map; take an in-memory copy before modifying
+            self.prototypes = np.array(self.prototypes)
+        if name in self.class_names:
+            class_id = self.class_names.index(name)
+        else:
+            class_id = len(self.class_names)
+            self.class_names.append(name)
+            self.prototypes = np.vstack([self.prototypes, np.zeros((1, self.dim), dtype=np.float32)])
+
+        self.supports = np.vstack([self.supports, x])
+        self.support_labels = np.concatenate([self.support_labels, np.full(len(x), class_id, dtype=np.int32)])
+
+        # Recompute the prototype from all supports of this class
+        members = self.supports[self.support_labels == class_id]
+        self.prototypes[class_id] = l2_normalize(members.mean(axis=0, keepdims=True))[0]
+        return class_id
+
+    def query(self, embeddings, k=1, mode="prototype"):
+        """
+        Classify a batch of embeddings.
+
+        Args:
+        - embeddings: Array of shape (n, dim).
+        - k: Number of ranked classes to return ('prototype') or neighbours to vote ('knn').
+        - mode: 'prototype' for nearest prototype, 'knn' for k-nearest supports.
+
+        Returns (class_names, scores): lists of length n; with mode 'prototype'
+        each entry holds the top-k classes and their cosine similarities.
+        """
+        if not self.class_names:
+            raise ValueError("The index has no registered classes.")
+        q = self._prepare(embeddings)
+
+        if mode == "prototype":
+            sims = q @ self.prototypes.T  # (n, classes)
+            k = min(k, len(self.class_names))
+            top = np.argsort(-sims, axis=1)[:, :k]
+            names = [[self.class_names[c] for c in row] for row in top]
+            scores = np.take_along_axis(sims, top, axis=1)
+            return names, scores
+
+        if mode == "knn":
+            sims = q @ self.supports.T  # (n, supports)
+            k = min(k, len(self.supports))
+            nearest = np.argpartition(-sims, k - 1, axis=1)[:, :k]
+            votes = self.support_labels[nearest]  # (n, k)
+            # Similarity-weighted vote over the k neighbours
+            weights = np.take_along_axis(sims, nearest, axis=1)
+            tally = np.zeros((len(q), len(self.class_names)), dtype=np.float32)
+            np.add.at(tally, (np.arange(len(q))[:, None], votes), weights)
+            best = tally.argmax(axis=1)
+            names = [self.class_names[c] for c in best]
+            return names, tally[np.arange(len(q)), best] / k
+
+        raise ValueError(f"Unknown query mode: {mode}")
+
+    def save(self, directory):
+        """Persist the index as plain .npy arrays plus a JSON header."""
+        os.makedirs(directory, exist_ok=True)
+        np.save(os.path.join(directory, "supports.npy"), self.supports)
+        np.save(os.path.join(directory, "support_labels.npy"), self.support_labels)
+        np.save(os.path.join(directory, "prototypes.npy"), self.prototypes)
+        if self.mean is not None:
+            np.save(os.path.join(directory, "mean.npy"), self.mean)
+            np.save(os.path.join(directory, "std.npy"), self.std)
+        with open(os.path.join(directory, "index.json"), "w") as f:
+            json.dump({"dim": self.dim, "embedding": self.embedding, "class_names": self.class_names}, f, indent=2)
+
+    @classmethod
+    def load(cls, directory, mmap_mode="r"):
+        """
+        Load an index saved with save().
+
+        The arrays are memory-mapped by default, so large support sets are paged
+        in on demand. Adding a class to a loaded index copies them into memory.
+        """
+        with open(os.path.join(directory, "index.json")) as f:
+            header = json.load(f)
+        mean = std = None
+        if os.path.exists(os.path.join(directory, "mean.npy")):
+            mean = np.load(os.path.join(directory, "mean.npy"))
+            std = np.load(os.path.join(directory, "std.npy"))
+        index = cls(header["dim"], embedding=header["embedding"], mean=mean, std=std)
+        index.class_names = header["class_names"]
+        index.supports = np.load(os.path.join(directory, "supports.npy"), mmap_mode=mmap_mode)
+        index.support_labels = np.load(os.path.join(directory, "support_labels.npy"), mmap_mode=mmap_mode)
+        index.prototypes = np.load(os.path.join(directory, "prototypes.npy"), mmap_mode=mmap_mode)
+        return index
+
+
+class CNNEmbedder:
+    """Penultimate Dense(128) activations of the trained cnn.py model for spectrogram images."""
+
+    def __init__(self, model_path=default_model_path, batch_size=32):
+        import tensorflow as tf
+        self.tf = tf
+        model = tf.keras.models.load_model(model_path)
+        # Dense(128) is the layer before the sigmoid output
+        self.model = tf.keras.Model(inputs=model.inputs, outputs=model.layers[-2].output)
+        self.batch_size = batch_size
+        self.dim = self.model.output_shape[-1]
+
+    def embed(self, image_paths):
+        batches = []
+        for i in range(0, len(image_paths), self.batch_size):
+            # Same preprocessing as the ImageDataGenerator in cnn.py
+            images = np.stack([
+                self.tf.keras.utils.img_to_array(self.tf.keras.utils.load_img(p, target_size=(224, 224))) / 255.0
+                for p in image_paths[i:i + self.batch_size]
+            ])
+            batches.append(self.model.predict(images, verbose=0))
+        return np.concatenate(batches) if batches else np.empty((0, self.dim), dtype=np.float32)
+
+
+class FeatureEmbedder:
+    """The 39-dim extract_features vector for .wav clips."""
+
+    dim = len(FEATURE_COLUMNS)
+
+    def __init__(self):
+        sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "Data_Analysis"))
+        from feature_extraction import extract_features
+        self.extract_features = extract_features
+
+    def embed(self, audio_files):
+        vectors = []
+        for audio_file in audio_files:
+            features = self.extract_features(audio_file, "", "")
+            if features is None:
+                raise ValueError(f"Could not extract features from {audio_file}")
+            # Tempo comes back as a one-element array from newer librosa versions
+            vectors.append([float(np.ravel(features[c])[0]) for c in FEATURE_COLUMNS])
+        return np.asarray(vectors, dtype=np.float32)
+
+
+def feature_statistics(features_csv):
+    """Per-column mean/std of an extracted_features.csv, for standardising feature embeddings."""
+    import pandas as pd
+    df = pd.read_csv(features_csv)
+    # Tempo may be stored as a one-element list such as '[117.45]'
+    values = df[FEATURE_COLUMNS].apply(lambda c: pd.to_numeric(c.astype(str).str.strip("[]"), errors="coerce"))
+    values = values.to_numpy(dtype=np.float32)
+    return np.nanmean(values, axis=0), np.nanstd(values, axis=0)
+
+
+def make_embedder(embedding, model_path=default_model_path):
+    if embedding == "cnn":
+        return CNNEmbedder(model_path)
+    if embedding == "features":
+        return FeatureEmbedder()
+    raise ValueError(f"Unknown embedding: {embedding}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Few-shot prototype index over audio embeddings.")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    add = sub.add_parser("add", help="Register a class from example clips (spectrograms for cnn, .wav for features).")
+    add.add_argument("index_dir")
+    add.add_argument("class_name")
+    add.add_argument("files", nargs="+")
+    add.add_argument("--embedding", choices=["cnn", "features"], default="cnn")
+    add.add_argument("--model", default=default_model_path)
+    add.add_argument("--features-csv", default=config["features_csv"],
+                     help="extracted_features.csv used to standardise feature embeddings.")
+
+    query = sub.add_parser("query", help="Classify clips against the registered classes.")
+    query.add_argument("index_dir")
+    query.add_argument("files", nargs="+")
+    query.add_argument("--mode", choices=["prototype", "knn"], default="prototype")
+    query.add_argument("-k", type=int, default=1)
+    query.add_argument("--model", default=default_model_path)
+
+    args = parser.parse_args()
+
+    if args.command == "add":
+        if os.path.exists(os.path.join(args.index_dir, "index.json")):
+            index = PrototypeIndex.load(args.index_dir, mmap_mode=None)
+            if index.embedding != args.embedding:
+                parser.error(f"Index was built from '{index.embedding}' embeddings, not '{args.embedding}'.")
+        else:
+            embedder_dim = 128 if args.embedding == "cnn" else FeatureEmbedder.dim
+            mean = std = None
+            if args.embedding == "features":
+                # Unstandardised, the spectral columns (in Hz) would dominate every similarity
+                if not os.path.exists(args.features_csv):
+                    parser.error(f"Feature embeddings need the extracted features for standardisation; "
+                                 f"{args.features_csv} not found (see --features-csv).")
+                mean, std = feature_statistics(args.features_csv)
+            index = PrototypeIndex(embedder_dim, embedding=args.embedding, mean=mean, std=std)
+
+        embeddings = make_embedder(args.embedding, args.model).embed(args.files)
+        start = time.perf_counter()
+        index.add_class(args.class_name, embeddings)
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        index.save(args.index_dir)
+        print(f"Registered '{args.class_name}' from {len(args.files)} clips in {elapsed_ms:.2f} ms "
+              f"({len(index.class_names)} classes in index).")
+
+    elif args.command == "query":
+        index = PrototypeIndex.load(args.index_dir)
+        embeddings = make_embedder(index.embedding, args.model).embed(args.files)
+        names, scores = index.query(embeddings, k=args.k, mode=args.mode)
+        for file, name, score in zip(args.files, names, scores):
+            print(f"{file}: {name} ({np.round(score, 4).tolist()})")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,177 @@
+import os
+import csv
+import json
+import time
+import resource
+import threading
+import tensorflow as tf
+
+# Fraction of a step spent waiting on the input pipeline above which an epoch is flagged
+INPUT_BOUND_THRESHOLD = 0.5
+
+
+def profiling_enabled():
+    """Instrumentation is opt-in: set PROFILE_TRAINING=1 to turn it on."""
+    return os.environ.get("PROFILE_TRAINING", "0") == "1"
+
+
+def peak_rss_mb():
+    """Peak resident set size of this process in MB (ru_maxrss is in KB on Linux)."""
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+
+
+class TimedSequence(tf.keras.utils.Sequence):
+    """
+    Sequence wrapper that times every batch fetched from the data source.
+
+    `fit` pulls the next batch inside its train function, after
+    `on_train_batch_begin`, so loading and decoding cannot be separated from
+    compute with callbacks alone. Wrapping the generator (an
+    ImageDataGenerator iterator or any Sequence) times `__getitem__` itself and
+    hands each duration to the profiler.
+
+    Args:
+    - sequence: The data source passed to `fit`.
+    - profiler: TrainingProfiler the fetch times are reported to.
+    """
+
+    def __init__(self, sequence, profiler):
+        super().__init__()
+        self.sequence = sequence
+        self.profiler = profiler
+        self.batch_size = getattr(sequence, "batch_size", None)
+
+    def __len__(self):
+        return len(self.sequence)
+
+    def __getitem__(self, index):
+        start = time.perf_counter()
+        batch = self.sequence[index]
+        self.profiler.record_fetch(time.perf_counter() - start)
+        return batch
+
+    def on_epoch_end(self):
+        # Lets ImageDataGenerator iterators reshuffle between epochs
+        if hasattr(self.sequence, "on_epoch_end"):
+            self.sequence.on_epoch_end()
+
+
+class TrainingProfiler(tf.keras.callbacks.Callback):
+    """
+    Keras callback recording a per-step timeline of a `model.fit` run.
+
+    The training data must be passed to `fit` through `wrap`, which times the
+    batch fetches. For every training step it records:
+    - input_wait_s: time spent fetching the step's batch from the data source
+      (loading, decoding and augmenting images on the host).
+    - compute_s: the rest of the step time (forward, backward, update).
+    - samples_per_sec: batch_size / step time.
+    - peak_rss_mb: peak resident memory of the process so far.
+
+    At the end of training the timeline is written as CSV and a per-epoch summary
+    as JSON into output_dir, and epochs whose input wait fraction exceeds
+    input_bound_threshold are flagged as input-bound.
+
+    Args:
+    - output_dir: Directory to write the timeline to (next to model_summary.txt).
+    - batch_size: Samples per step, used for throughput.
+    - prefix: File name prefix, so several models can share one results directory.
+    - input_bound_threshold: Input wait fraction above which an epoch is input-bound.
+    """
+
+    def __init__(self, output_dir, batch_size, prefix="training", input_bound_threshold=INPUT_BOUND_THRESHOLD):
+        super().__init__()
+        self.output_dir = output_dir
+        self.batch_size = batch_size
+        self.prefix = prefix
+        self.input_bound_threshold = input_bound_threshold
+        self.steps = []
+        self.epochs = []
+        self._epoch = 0
+        self._epoch_start = None
+        self._last_step_end = None
+        # Fetch time since the end of the previous step; fetches may come from a loader thread
+        self._fetch_s = 0.0
+        self._fetch_lock = threading.Lock()
+
+    def wrap(self, sequence):
+        """The data source to pass to `fit` so its batch fetches are timed."""
+        return TimedSequence(sequence, self)
+
+    def record_fetch(self, seconds):
+        with self._fetch_lock:
+            self._fetch_s += seconds
+
+    def _take_fetch_time(self):
+        with self._fetch_lock:
+            seconds, self._fetch_s = self._fetch_s, 0.0
+        return seconds
+
+    def on_epoch_begin(self, epoch, logs=None):
+        self._epoch = epoch
+        self._epoch_start = time.perf_counter()
+        # The first step of an epoch runs from the epoch start; validation fetches are not counted
+        self._last_step_end = self._epoch_start
+        self._take_fetch_time()
+
+    def on_train_batch_end(self, batch, logs=None):
+        now = time.perf_counter()
+        step_time = now - self._last_step_end
+        input_wait = min(self._take_fetch_time(), step_time)
+        compute = step_time - input_wait
+        self.steps.append({
+            "epoch": self._epoch,
+            "step": batch,
+            "input_wait_s": input_wait,
+            "compute_s": compute,
+            "samples_per_sec": self.batch_size / step_time if step_time > 0 else 0.0,
+            "peak_rss_mb": peak_rss_mb(),
+        })
+        self._last_step_end = now
+
+    def on_epoch_end(self, epoch, logs=None):
+        epoch_steps = [s for s in self.steps if s["epoch"] == epoch]
+        input_wait = sum(s["input_wait_s"] for s in epoch_steps)
+        compute = sum(s["compute_s"] for s in epoch_steps)
+        wall = time.perf_counter() - self._epoch_start
+        input_fraction = input_wait / (input_wait + compute) if epoch_steps else 0.0
+        summary = {
+            "epoch": epoch,
+            "steps": len(epoch_steps),
+            "wall_s": wall,
+            "input_wait_s": input_wait,
+            "compute_s": compute,
+            # Whatever is left is validation and callback overhead
+            "other_s": wall - input_wait - compute,
+            "input_wait_fraction": input_fraction,
+            "samples_per_sec": len(epoch_steps) * self.batch_size / (input_wait + compute) if epoch_steps else 0.0,
+            "peak_rss_mb": peak_rss_mb(),
+            "input_bound": input_fraction > self.input_bound_threshold,
+        }
+        self.epochs.append(summary)
+        if summary["input_bound"]:
+            print(f"Epoch {epoch + 1} is input-bound: {input_fraction:.0%} of step time spent waiting on input.")
+
+    def on_train_end(self, logs=None):
+        self.save()
+
+    def save(self):
+        """Write the step timeline (CSV) and epoch summary (JSON) to output_dir."""
+        os.makedirs(self.output_dir, exist_ok=True)
+        timeline_csv = os.path.join(self.output_dir, f"{self.prefix}_timeline.csv")
+        with open(timeline_csv, mode="w", newline="") as file:
+            writer = csv.DictWriter(file, fieldnames=["epoch", "step", "input_wait_s", "compute_s",
+                                                      "samples_per_sec", "peak_rss_mb"])
+            writer.writeheader()
+            writer.writerows(self.steps)
+
+        profile_json = os.path.join(self.output_dir, f"{self.prefix}_profile.json")
+        with open(profile_json, "w") as f:
+            json.dump({
+                "batch_size": self.batch_size,
+                "input_bound_threshold": self.input_bound_threshold,
+                "input_bound_epochs": [e["epoch"] for e in self.epochs if e["input_bound"]],
+                "epochs": self.epochs,
+            }, f, indent=2)
+
+        print(f"Training profile saved to {profile_json} and {timeline_csv}")
@@ -0,0 +1,263 @@
+import os
+import sys
+import json
+import time
+import fnmatch
+import hashlib
+import argparse
+import subprocess
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+import manifest
+from pipeline_config import config, CONFIG_PATH
+from pipeline_executor import available_cpus
+
+# Repository root; stage scripts are given relative to it
+ROOT = os.path.dirname(os.path.abspath(__file__))
+
+
+class Stage:
+    """
+    One step of the pipeline.
+
+    Args:
+    - name: Stage name.
+    - script: Script run for the stage, relative to the repository root.
+    - args: Extra command line arguments for the script.
+    - deps: Stages that must finish first.
+    - inputs: (config key, file name pattern) pairs whose contents the stage
+      depends on; a pattern of None means the config key names a single file.
+    - exclude: File name patterns left out of the inputs.
+    - outputs: Config keys of files or directories the stage must leave behind.
+    - config_keys: Configuration values that change what the stage does.
+    """
+
+    def __init__(self, name, script, args=(), deps=(), inputs=(), exclude=(), outputs=(), config_keys=()):
+        self.name = name
+        self.script = script
+        self.args = list(args)
+        self.deps = list(deps)
+        self.inputs = list(inputs)
+        self.exclude = list(exclude)
+        self.outputs = list(outputs)
+        self.config_keys = list(config_keys)
+
+
+SOUNDS = ("emergency_sounds_dir", "normal_sounds_dir")
+SPECTROGRAMS = ("emergency_spectrograms_dir", "normal_spectrograms_dir")
+# Gate thresholds decide which clips the later audio stages skip
+GATE_KEYS = ["gate_frame_ms", "gate_probe_frames", "gate_silence_dbfs", "gate_min_active_fraction",
+             "gate_min_peak_dbfs", "gate_max_clipped_fraction"]
+# Copies augment writes next to the clips; the stages before it must not depend on them
+AUGMENTED = [f"*_{augmentation}_[0-9]*.wav" for augmentation in manifest.AUGMENTATIONS]
+
+# download -> convert -> trim -> gate -> augment -> features -> filter / plots
+#                                                -> spectrograms -> train
+STAGES = [
+    Stage("download", "audio_downloader.py",
+          inputs=[(key, "*.csv") for key in SOUNDS], config_keys=["download_limit_per_class"]),
+    Stage("convert", "wav_convertor.py", args=["convert"], deps=["download"],
+          inputs=[(key, pattern) for key in SOUNDS for pattern in ("*.m4a", "*.webm")]),
+    Stage("trim", "trimmer.py", deps=["convert"],
+          inputs=[(key, pattern) for key in SOUNDS for pattern in ("*.csv", "*.wav")], exclude=AUGMENTED),
+    Stage("count", "files_count.py", deps=["trim"],
+          inputs=[(key, "*.wav") for key in SOUNDS], exclude=AUGMENTED, outputs=["file_count_report"]),
+    Stage("gate", "silence_gate.py", deps=["trim"],
+          inputs=[(key, "*.wav") for key in SOUNDS], exclude=AUGMENTED, config_keys=GATE_KEYS),
+    Stage("augment", "Data_Analysis/data_aug.py", deps=["gate"],
+          inputs=[(key, "*.wav") for key in SOUNDS], config_keys=["augment_target_count"] + GATE_KEYS),
+    Stage("features", "Data_Analysis/feature_extraction.py", deps=["augment"],
+          inputs=[(key, "*.wav") for key in SOUNDS], outputs=["features_csv"], config_keys=GATE_KEYS),
+    Stage("filter", "deletor.py", deps=["features"],
+          inputs=[("features_csv", None)], outputs=["filtered_features_csv"], config_keys=["excluded_classes"]),
+    Stage("plots", "Data_Analysis/plots.py", deps=["features"],
+          inputs=[("features_csv", None)], outputs=["visualizations_dir"]),
+    Stage("spectrograms", "spectrogram_to_csv/code.py", deps=["augment"],
+          inputs=[(key, "*.png") for key in SPECTROGRAMS], outputs=["emergency_labels_csv", "normal_labels_csv"]),
+    Stage("train", "neural-networks-and-results/cnn.py", deps=["spectrograms"],
+          inputs=[("emergency_labels_csv", None), ("normal_labels_csv", None)] + [(key, "*.png") for key in SPECTROGRAMS],
+          outputs=["results_dir"]),
+]
+STAGES_BY_NAME = {stage.name: stage for stage in STAGES}
+
+
+def input_files(stage):
+    """Every file a stage declares as input, in a stable order."""
+    files = []
+    for key, pattern in stage.inputs:
+        path = config[key]
+        if pattern is None:
+            if os.path.exists(path):
+                files.append(path)
+            continue
+        for root, dirs, names in os.walk(path):
+            dirs.sort()
+            files.extend(os.path.join(root, name) for name in sorted(names) if fnmatch.fnmatch(name, pattern)
+                         and not any(fnmatch.fnmatch(name, excluded) for excluded in stage.exclude))
+    return files
+
+
+def fingerprint(conn, stage):
+    """
+    Content hash over the stage script, the configuration it uses and all of its inputs.
+
+    File hashes are cached in the manifest by (size, mtime), so only files that
+    changed since the last run are read again.
+    """
+    h = hashlib.sha1()
+    h.update(manifest.cached_file_hash(conn, os.path.join(ROOT, stage.script)).encode())
+    h.update(json.dumps(stage.args).encode())
+    h.update(json.dumps({key: config[key] for key in stage.config_keys}, sort_keys=True).encode())
+    for path in input_files(stage):
+        h.update(path.encode())
+        h.update(manifest.cached_file_hash(conn, path).encode())
+    return h.hexdigest()
+
+
+def is_stale(conn, stage):
+    """
+    A stage reruns if an output is missing or its fingerprint changed.
+
+    Upstream stages reach a stage only through its declared inputs, so an
+    upstream run that leaves them byte-identical does not make it stale.
+    """
+    missing = [key for key in stage.outputs if not os.path.exists(config[key])]
+    if missing:
+        return True, f"missing outputs: {', '.join(missing)}"
+    if manifest.stage_fingerprint(conn, stage.name) != fingerprint(conn, stage):
+        return True, "inputs changed"
+    return False, "up to date"
+
+
+def run_stage(stage, cpus):
+    """Run a stage script in its own directory, as the scripts expect, sizing its pools to `cpus` CPUs."""
+    script = os.path.join(ROOT, stage.script)
+    start = time.perf_counter()
+    env = dict(os.environ, PIPELINE_CONFIG=CONFIG_PATH, EXECUTOR_CPUS=str(cpus))
+    result = subprocess.run([sys.executable, os.path.basename(script)] + stage.args,
+                            cwd=os.path.dirname(script), env=env)
+    return result.returncode, time.perf_counter() - start
+
+
+def selected_stages(targets):
+    """The target stages plus everything they depend on (all stages by default)."""
+    if not targets:
+        return list(STAGES)
+    needed = set()
+    pending = list(targets)
+    while pending:
+        name = pending.pop()
+        if name not in needed:
+            needed.add(name)
+            pending.extend(STAGES_BY_NAME[name].deps)
+    return [stage for stage in STAGES if stage.name in needed]
+
+
+def run(targets=(), force=False, dry_run=False, max_parallel=2):
+    """
+    Run stale stages in dependency order, independent stages concurrently.
+
+    Args:
+    - targets: Stages to bring up to date (with their dependencies); all by default.
+    - force: Rerun every selected stage.
+    - dry_run: Only report what would run.
+    - max_parallel: Maximum number of stages running at once; stages started
+      together divide the CPUs between them.
+
+    Returns True if every stage succeeded or was up to date.
+    """
+    conn = manifest.connect()
+    stages = selected_stages(targets)
+    names = {stage.name for stage in stages}
+    done, ran, failed = set(), set(), set()
+    running = {}
+    cpus = available_cpus()
+
+    with ThreadPoolExecutor(max_workers=max_parallel) as executor:
+        while len(done) + len(failed) < len(stages):
+            progressed = False
+            ready = []
+            for stage in stages:
+                if stage.name in done or stage.name in failed or stage.name in running.values():
+                    continue
+                deps = [d for d in stage.deps if d in names]
+                if any(d in failed for d in deps):
+                    print(f"[pipeline] {stage.name}: skipped, a dependency failed")
+                    failed.add(stage.name)
+                    progressed = True
+                    continue
+                if not all(d in done for d in deps):
+                    continue
+                progressed = True
+
+                stale, reason = (True, "forced") if force else is_stale(conn, stage)
+                if not stale and dry_run and any(d in ran for d in deps):
+                    # Its inputs may change once the upstream stages have actually run
+                    stale, reason = True, "if upstream outputs change"
+                if not stale:
+                    print(f"[pipeline] {stage.name}: {reason}")
+                    done.add(stage.name)
+                    continue
+                print(f"[pipeline] {stage.name}: {'would run' if dry_run else 'running'} ({reason})")
+                if dry_run:
+                    done.add(stage.name)
+                    ran.add(stage.name)
+                    continue
+                ready.append(stage)
+
+            # Stages running at the same time share the CPUs instead of each sizing its pools to all of them
+            concurrent = min(max_parallel, len(running) + len(ready))
+            for stage in ready:
+                running[executor.submit(run_stage, stage, max(1, cpus // concurrent))] = stage.name
+
+            if not running:
+                if not progressed:
+                    raise RuntimeError("Stage dependencies cannot be satisfied")
+                continue
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                name = running.pop(future)
+                returncode, elapsed = future.result()
+                if returncode == 0:
+                    # Fingerprint after the run, so in-place outputs count as the new baseline
+                    manifest.set_stage_fingerprint(conn, name, fingerprint(conn, STAGES_BY_NAME[name]))
+                    print(f"[pipeline] {name}: finished in {elapsed:.1f}s")
+                    done.add(name)
+                    ran.add(name)
+                else:
+                    print(f"[pipeline] {name}: FAILED with exit code {returncode} after {elapsed:.1f}s")
+                    failed.add(name)
+
+    return not failed
+
+
+def status():
+    """Print whether each stage is up to date, without running anything."""
+    conn = manifest.connect()
+    for stage in STAGES:
+        stale, reason = is_stale(conn, stage)
+        print(f"{stage.name:<13} {'STALE' if stale else 'ok':<6} {reason}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the audio pipeline, rerunning only stale stages.")
+    sub = parser.add_subparsers(dest="command", required=True)
+    run_parser = sub.add_parser("run", help="Bring stages up to date.")
+    run_parser.add_argument("stages", nargs="*", help=f"Target stages (default: all): {', '.join(STAGES_BY_NAME)}.")
+    run_parser.add_argument("--force", action="store_true", help="Rerun selected stages even if up to date.")
+    run_parser.add_argument("--dry-run", action="store_true", help="Only show what would run.")
+    run_parser.add_argument("--parallel", type=int, default=2, help="Maximum number of stages running at once.")
+    sub.add_parser("status", help="Show which stages are stale.")
+    args = parser.parse_args()
+
+    if args.command == "status":
+        status()
+        return
+    unknown = [name for name in args.stages if name not in STAGES_BY_NAME]
+    if unknown:
+        parser.error(f"Unknown stages: {', '.join(unknown)}")
+    ok = run(args.stages, force=args.force, dry_run=args.dry_run, max_parallel=args.parallel)
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,31 @@
+import os
+import json
+
+# Single configuration file for every pipeline script (override with PIPELINE_CONFIG)
+CONFIG_PATH = os.environ.get("PIPELINE_CONFIG", os.path.join(os.path.dirname(os.path.abspath(__file__)), "pipeline.json"))
+
+# Keys holding paths; relative paths are resolved against the directory of the config file
+PATH_KEYS = (
+    "emergency_sounds_dir", "normal_sounds_dir", "features_csv", "filtered_features_csv", "file_count_report",
+    "visualizations_dir", "emergency_spectrograms_dir", "normal_spectrograms_dir", "emergency_labels_csv",
+    "normal_labels_csv", "results_dir", "manifest_path", "metrics_dir", "shards_dir",
+)
+
+
+def load_config(path=CONFIG_PATH):
+    """Load the pipeline configuration with every path made absolute."""
+    with open(path) as f:
+        config = json.load(f)
+    base = os.path.dirname(os.path.abspath(path))
+    for key in PATH_KEYS:
+        if key in config:
+            config[key] = os.path.normpath(os.path.join(base, config[key]))
+    return config
+
+
+config = load_config()
+
+
+def main_folders():
+    """The two class-folder roots, emergency first."""
+    return [config["emergency_sounds_dir"], config["normal_sounds_dir"]]
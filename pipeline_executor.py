@@ -0,0 +1,198 @@
+import os
+import sys
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, wait, FIRST_COMPLETED
+from pipeline_config import config
+
+# Thread pool variables of the numeric libraries used in the workers (numpy/scipy BLAS, librosa, numexpr)
+BLAS_ENV_VARS = ("OMP_NUM_THREADS", "OPENBLAS_NUM_THREADS", "MKL_NUM_THREADS",
+                 "NUMEXPR_NUM_THREADS", "VECLIB_MAXIMUM_THREADS")
+
+# Keeps the threadpoolctl limits of a worker alive
+_thread_limits = None
+
+# CPUs a stage may use when it shares the machine with other stages (set by pipeline.py)
+CPU_SHARE = os.environ.get("EXECUTOR_CPUS")
+
+
+def available_cpus():
+    """CPUs this process may run on (respects taskset/cgroup affinity and EXECUTOR_CPUS)."""
+    if hasattr(os, "sched_getaffinity"):
+        cpus = len(os.sched_getaffinity(0))
+    else:
+        cpus = os.cpu_count() or 1
+    if CPU_SHARE:
+        cpus = max(1, min(cpus, int(CPU_SHARE)))
+    return cpus
+
+
+def available_memory():
+    """Bytes of memory available for new work (MemAvailable), or None if unknown."""
+    try:
+        with open("/proc/meminfo") as f:
+            for line in f:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    try:
+        return os.sysconf("SC_AVPHYS_PAGES") * os.sysconf("SC_PAGE_SIZE")
+    except (ValueError, OSError, AttributeError):
+        return None
+
+
+def limit_blas_threads(n=config["executor_blas_threads"]):
+    """
+    Pin numeric library thread pools to n threads.
+
+    The environment variables cover libraries loaded after this call (and are
+    inherited by worker processes); threadpoolctl, if installed, also limits
+    libraries that are already loaded.
+    """
+    global _thread_limits
+    for var in BLAS_ENV_VARS:
+        os.environ[var] = str(n)
+    try:
+        from threadpoolctl import threadpool_limits
+        _thread_limits = threadpool_limits(limits=n)
+    except ImportError:
+        pass
+
+
+def pool_size(kind="cpu", worker_memory_mb=None, max_workers=None):
+    """
+    Number of workers that fits this machine.
+
+    Args:
+    - kind: 'cpu' for compute-bound work (one worker per available CPU), 'io'
+      for work that mostly waits on the network or subprocesses
+      (executor_io_factor workers per CPU).
+    - worker_memory_mb: Resident memory of an idle worker; workers are capped so
+      they fit into executor_memory_fraction of the available memory.
+    - max_workers: Upper bound (default: executor_max_workers from the config).
+    """
+    cpus = available_cpus()
+    workers = cpus * config["executor_io_factor"] if kind == "io" else cpus
+    memory = available_memory()
+    worker_memory_mb = worker_memory_mb or config["executor_worker_memory_mb"]
+    if memory:
+        workers = min(workers, int(memory * config["executor_memory_fraction"] / (worker_memory_mb * 2 ** 20)))
+    max_workers = max_workers or config["executor_max_workers"]
+    if max_workers:
+        workers = min(workers, max_workers)
+    return max(1, workers)
+
+
+def decode_cost(*paths):
+    """Estimated peak memory for decoding the largest of the given audio files."""
+    sizes = [os.path.getsize(path) for path in paths if os.path.exists(path)]
+    return max(sizes, default=0) * config["executor_decode_factor"]
+
+
+class SharedExecutor:
+    """
+    Process (or thread) pool sized from the machine, shared by the pipeline stages.
+
+    - The pool size comes from `pool_size`, so it follows the CPUs and memory of
+      the node instead of a hard-coded count.
+    - BLAS/OpenMP pools in the workers are pinned to executor_blas_threads, so N
+      workers use N cores rather than N x cores threads.
+    - Tasks are admitted while the summed memory estimate of the tasks in
+      flight fits the memory budget, what is left of executor_memory_fraction
+      of the available memory once every worker process holds worker_memory_mb;
+      a task that does not fit waits for running ones to finish (a single
+      oversized task still runs alone).
+    - Worker processes are replaced after about executor_max_items_per_child
+      work items (files or rows; a task holds task_weight of them) to contain
+      leaks. This needs the 'spawn' start method (Python 3.11+), which re-imports
+      the worker script on every replacement, so worker scripts must keep their
+      entry point and any loading of data under `if __name__ == "__main__"`.
+
+    Args:
+    - stage: Name used in the startup line.
+    - kind: 'cpu' or 'io', see `pool_size`.
+    - max_workers: Upper bound on the pool size.
+    - worker_memory_mb: Resident memory of an idle worker.
+    - threads: Use threads instead of processes (for work that runs subprocesses).
+    - task_weight: Mean number of work items in a task.
+    """
+
+    def __init__(self, stage, kind="cpu", max_workers=None, worker_memory_mb=None, threads=False, task_weight=1):
+        self.stage = stage
+        self.max_workers = pool_size(kind, worker_memory_mb, max_workers)
+        memory = available_memory()
+        self.memory_budget = memory * config["executor_memory_fraction"] if memory else None
+        if self.memory_budget is not None and not threads:
+            # Resident memory of the worker processes themselves, busy or idle
+            worker_memory_mb = worker_memory_mb or config["executor_worker_memory_mb"]
+            self.memory_budget = max(0, self.memory_budget - self.max_workers * worker_memory_mb * 2 ** 20)
+        if threads:
+            self.executor = ThreadPoolExecutor(max_workers=self.max_workers)
+        else:
+            # Inherited by the workers before they import numpy
+            limit_blas_threads()
+            kwargs = {"initializer": limit_blas_threads}
+            max_items = config["executor_max_items_per_child"]
+            if max_items and sys.version_info >= (3, 11):
+                kwargs.update(max_tasks_per_child=max(1, int(max_items / task_weight)),
+                              mp_context=multiprocessing.get_context("spawn"))
+            self.executor = ProcessPoolExecutor(max_workers=self.max_workers, **kwargs)
+        budget = f", memory budget {self.memory_budget / 2 ** 30:.1f} GiB" if self.memory_budget is not None else ""
+        print(f"[{stage}] {self.max_workers} {'threads' if threads else 'workers'}{budget}", flush=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.shutdown()
+
+    def shutdown(self):
+        self.executor.shutdown()
+
+    def submit(self, fn, *args):
+        return self.executor.submit(fn, *args)
+
+    def map_unordered(self, fn, tasks, cost=None, return_exceptions=False):
+        """
+        Run fn over tasks and yield results as they finish.
+
+        Args:
+        - fn: Picklable function taking one task.
+        - tasks: Iterable of tasks.
+        - cost: Function estimating a task's peak memory in bytes (see
+          `decode_cost`); without it only the pool size limits concurrency.
+        - return_exceptions: Yield a task's exception instead of raising it.
+        """
+        tasks = iter(tasks)
+        in_flight = {}
+        in_flight_cost = 0
+        held = None
+        exhausted = False
+        while True:
+            # Keep every worker busy while the estimated memory fits the budget
+            while len(in_flight) < self.max_workers and not exhausted:
+                if held is None:
+                    try:
+                        task = next(tasks)
+                    except StopIteration:
+                        exhausted = True
+                        break
+                    held = (task, cost(task) if cost else 0)
+                task, task_cost = held
+                if in_flight and self.memory_budget is not None and in_flight_cost + task_cost > self.memory_budget:
+                    break
+                in_flight[self.executor.submit(fn, task)] = task_cost
+                in_flight_cost += task_cost
+                held = None
+            if not in_flight:
+                return
+            done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                in_flight_cost -= in_flight.pop(future)
+                try:
+                    result = future.result()
+                except Exception as e:
+                    if not return_exceptions:
+                        raise
+                    result = e
+                yield result
@@ -0,0 +1,181 @@
+import os
+import json
+import math
+import time
+from contextlib import contextmanager
+from pipeline_config import config
+
+# Directory the final metrics files are written to (override with METRICS_DIR)
+METRICS_DIR = os.environ.get("METRICS_DIR", config["metrics_dir"])
+
+# Seconds between aggregated progress lines
+REPORT_INTERVAL = float(os.environ.get("METRICS_REPORT_INTERVAL", "10"))
+
+
+def bucket_of(seconds):
+    """Latency histogram bucket: powers of two of a millisecond (<=1ms, <=2ms, <=4ms, ...)."""
+    ms = seconds * 1000.0
+    return 0 if ms <= 1.0 else int(math.ceil(math.log2(ms)))
+
+
+class StageMetrics:
+    """
+    Counters, a per-item latency histogram and phase timings for one pipeline stage.
+
+    Recording an item is two perf_counter calls and a few dict updates, so it
+    can stay on in production. In a process pool every worker keeps its own
+    instance and hands back `drain()` snapshots with its results; the parent
+    merges them, prints one aggregated progress line per interval and writes
+    the final JSON file.
+
+    Args:
+    - stage: Stage name, used in progress lines and the metrics file name.
+    - total: Expected number of items, if known (enables percentage and ETA).
+    - interval: Minimum seconds between progress lines.
+    """
+
+    def __init__(self, stage, total=None, interval=REPORT_INTERVAL):
+        self.stage = stage
+        self.total = total
+        self.interval = interval
+        self.started = time.time()
+        self._last_report = time.perf_counter()
+        self.reset()
+
+    def reset(self):
+        self.items = 0
+        self.errors = 0
+        self.latency_sum = 0.0
+        self.latency_max = 0.0
+        self.histogram = {}
+        self.counters = {}
+        self.phases = {}
+
+    def item(self, seconds, ok=True):
+        """Record one processed item and how long it took."""
+        self.items += 1
+        if not ok:
+            self.errors += 1
+        self.latency_sum += seconds
+        if seconds > self.latency_max:
+            self.latency_max = seconds
+        b = bucket_of(seconds)
+        self.histogram[b] = self.histogram.get(b, 0) + 1
+
+    def incr(self, name, n=1):
+        self.counters[name] = self.counters.get(name, 0) + n
+
+    @contextmanager
+    def time_item(self):
+        """Time the body as one item; an exception counts as an error and is re-raised."""
+        start = time.perf_counter()
+        try:
+            yield
+        except Exception:
+            self.item(time.perf_counter() - start, ok=False)
+            raise
+        self.item(time.perf_counter() - start)
+
+    @contextmanager
+    def phase(self, name):
+        """Accumulate wall time of a named phase (e.g. 'train', 'evaluate')."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phases[name] = self.phases.get(name, 0.0) + time.perf_counter() - start
+
+    def snapshot(self):
+        return {
+            "items": self.items,
+            "errors": self.errors,
+            "latency_sum": self.latency_sum,
+            "latency_max": self.latency_max,
+            "histogram": dict(self.histogram),
+            "counters": dict(self.counters),
+            "phases": dict(self.phases),
+        }
+
+    def drain(self):
+        """Snapshot and reset; what a worker returns alongside its results."""
+        snap = self.snapshot()
+        self.reset()
+        return snap
+
+    def merge(self, snap):
+        """Fold a worker snapshot into this instance."""
+        if not snap:
+            return
+        self.items += snap["items"]
+        self.errors += snap["errors"]
+        self.latency_sum += snap["latency_sum"]
+        self.latency_max = max(self.latency_max, snap["latency_max"])
+        # JSON round trips turn bucket keys into strings
+        for b, n in snap["histogram"].items():
+            self.histogram[int(b)] = self.histogram.get(int(b), 0) + n
+        for name, n in snap["counters"].items():
+            self.counters[name] = self.counters.get(name, 0) + n
+        for name, seconds in snap["phases"].items():
+            self.phases[name] = self.phases.get(name, 0.0) + seconds
+
+    def quantile(self, q):
+        """Approximate latency quantile in seconds (upper bound of the histogram bucket)."""
+        if not self.items:
+            return 0.0
+        target = q * self.items
+        seen = 0
+        for b in sorted(self.histogram):
+            seen += self.histogram[b]
+            if seen >= target:
+                return (2 ** b) / 1000.0
+        return self.latency_max
+
+    def summary(self):
+        elapsed = time.time() - self.started
+        rate = self.items / elapsed if elapsed > 0 else 0.0
+        summary = {
+            "stage": self.stage,
+            "started": self.started,
+            "elapsed_s": elapsed,
+            "items": self.items,
+            "total": self.total,
+            "errors": self.errors,
+            "error_rate": self.errors / self.items if self.items else 0.0,
+            "items_per_sec": rate,
+            "latency_mean_s": self.latency_sum / self.items if self.items else 0.0,
+            "latency_p50_s": self.quantile(0.5),
+            "latency_p95_s": self.quantile(0.95),
+            "latency_p99_s": self.quantile(0.99),
+            "latency_max_s": self.latency_max,
+            "latency_histogram_ms": {f"<={2 ** b}": n for b, n in sorted(self.histogram.items())},
+            "counters": self.counters,
+            "phases_s": self.phases,
+        }
+        if self.total and rate > 0:
+            summary["eta_s"] = max(self.total - self.items, 0) / rate
+        return summary
+
+    def report(self, force=False):
+        """Print one aggregated progress line if the interval has passed (or force is set)."""
+        now = time.perf_counter()
+        if not force and now - self._last_report < self.interval:
+            return
+        self._last_report = now
+        s = self.summary()
+        progress = f"{s['items']}/{s['total']} ({s['items'] / s['total']:.1%})" if s["total"] else f"{s['items']}"
+        line = (f"[{self.stage}] {progress} items, {s['items_per_sec']:.1f}/s, "
+                f"p50 {s['latency_p50_s'] * 1000:.0f}ms p95 {s['latency_p95_s'] * 1000:.0f}ms, {s['errors']} errors")
+        if "eta_s" in s:
+            line += f", ETA {s['eta_s'] / 60:.1f}m"
+        if self.counters:
+            line += ", " + ", ".join(f"{k}={v}" for k, v in sorted(self.counters.items()))
+        print(line, flush=True)
+
+    def write_json(self, path=None):
+        """Write the final metrics file (default: METRICS_DIR/<stage>.json)."""
+        path = path or os.path.join(METRICS_DIR, f"{self.stage}.json")
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with open(path, "w") as f:
+            json.dump(self.summary(), f, indent=2)
+        print(f"[{self.stage}] metrics saved to {path}")
+        return path
@@ -0,0 +1,182 @@
+import os
+import sys
+import json
+import time
+import hashlib
+import argparse
+import subprocess
+from pipeline_config import config, CONFIG_PATH
+from pipeline_executor import available_cpus
+
+# Shared directory every shard writes its output partition and record to
+SHARDS_DIR = config["shards_dir"]
+
+
+def shard_of(key, num_shards):
+    """
+    Shard an item belongs to, from a hash of its key.
+
+    Keys are paths relative to the data root (e.g. 'emergency sounds/Alarm/x_1.wav'),
+    so every node computes the same assignment whatever its mount point.
+    """
+    digest = hashlib.sha1(key.encode("utf-8")).hexdigest()
+    return int(digest[:16], 16) % num_shards
+
+
+def partition_path(stage, shard, num_shards, extension):
+    """Output partition of one shard, e.g. shards/features/00003-of-00008.csv."""
+    return os.path.join(SHARDS_DIR, stage, f"{shard:05d}-of-{num_shards:05d}{extension}")
+
+
+def write_atomic(path, write):
+    """Write through a temporary file and rename, so readers never see a partial partition."""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = f"{path}.{os.getpid()}.tmp"
+    write(tmp)
+    os.replace(tmp, path)
+
+
+def inputs_path(stage, num_shards):
+    """Manifest state the shards of a run read, e.g. shards/features/inputs-of-00008.json."""
+    return os.path.join(SHARDS_DIR, stage, f"inputs-of-{num_shards:05d}.json")
+
+
+def write_inputs(stage, num_shards, inputs):
+    """
+    Snapshot what the shards need from the manifest, on the node that holds it.
+
+    Shards on other nodes read this file instead of opening the SQLite
+    manifest, whose WAL mode does not work over network filesystems. A
+    previous run's partitions are removed, so the new run starts clean.
+    """
+    clear_stage(stage, num_shards)
+
+    def write(tmp):
+        with open(tmp, "w") as f:
+            json.dump(inputs, f)
+
+    path = inputs_path(stage, num_shards)
+    write_atomic(path, write)
+    return path
+
+
+def load_inputs(stage, num_shards):
+    """The snapshot written by `write_inputs`, or None if the run was not prepared."""
+    path = inputs_path(stage, num_shards)
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return json.load(f)
+
+
+def write_record(stage, shard, num_shards, record):
+    """Mark a shard finished; the record lists the items it was assigned and what it produced."""
+    record = dict(record, stage=stage, shard=shard, num_shards=num_shards, host=os.uname().nodename,
+                  finished_at=time.time())
+
+    def write(tmp):
+        with open(tmp, "w") as f:
+            json.dump(record, f)
+
+    path = partition_path(stage, shard, num_shards, ".json")
+    write_atomic(path, write)
+    return path
+
+
+def load_records(stage, num_shards):
+    """Records of the finished shards and the indices of the missing ones."""
+    records, missing = [], []
+    for shard in range(num_shards):
+        path = partition_path(stage, shard, num_shards, ".json")
+        if not os.path.exists(path):
+            missing.append(shard)
+            continue
+        with open(path) as f:
+            records.append(json.load(f))
+    return records, missing
+
+
+def check_complete(stage, num_shards, expected_keys):
+    """
+    Verify that the shards of a stage together covered exactly the expected items.
+
+    Each record must list the keys its shard was assigned. Returns the records
+    and a list of problems (empty when the run is complete): missing shards,
+    keys in the wrong shard, keys processed twice, expected keys no shard
+    processed, and keys whose files disappeared since the shards ran.
+    """
+    records, missing = load_records(stage, num_shards)
+    problems = [f"shard {shard} has not finished" for shard in missing]
+    seen = {}
+    for record in records:
+        for key in record["keys"]:
+            if shard_of(key, num_shards) != record["shard"]:
+                problems.append(f"{key} was processed by shard {record['shard']}, not its own shard")
+            if key in seen:
+                problems.append(f"{key} was processed by shards {seen[key]} and {record['shard']}")
+            seen[key] = record["shard"]
+    if not missing:
+        unprocessed = sorted(set(expected_keys) - set(seen))
+        problems.extend(f"{key} was not processed by any shard" for key in unprocessed[:20])
+        if len(unprocessed) > 20:
+            problems.append(f"... and {len(unprocessed) - 20} more unprocessed items")
+    vanished = sorted(set(seen) - set(expected_keys))
+    if vanished:
+        problems.append(f"{len(vanished)} processed items no longer exist (e.g. {vanished[0]})")
+    return records, problems
+
+
+def clear_stage(stage, num_shards):
+    """Remove a previous run's partitions of a stage, so a new sharded run starts clean."""
+    directory = os.path.join(SHARDS_DIR, stage)
+    if not os.path.isdir(directory):
+        return
+    for name in os.listdir(directory):
+        if f"-of-{num_shards:05d}" in name:
+            os.remove(os.path.join(directory, name))
+
+
+def launch_local(script, num_shards, extra_args=()):
+    """
+    Prepare a sharded run, run every shard as a local process against the shared directory, then merge.
+
+    Used to exercise the sharded mode on one machine; on several nodes the
+    node holding the manifest runs '<script> --prepare --num-shards K', each
+    node runs '<script> --shard I --num-shards K' itself and the manifest's
+    node runs '<script> --merge --num-shards K' at the end. The CPUs are
+    divided between the local shards.
+    """
+    script = os.path.abspath(script)
+    stage = os.path.splitext(os.path.basename(script))[0]
+    workers = max(1, available_cpus() // num_shards)
+    env = dict(os.environ, PIPELINE_CONFIG=CONFIG_PATH)
+    cwd = os.path.dirname(script)
+    if subprocess.call([sys.executable, os.path.basename(script), "--prepare", "--num-shards", str(num_shards)]
+                       + list(extra_args), cwd=cwd, env=env) != 0:
+        print(f"[{stage}] could not prepare the shards")
+        return 1
+    shard_env = dict(env, EXECUTOR_CPUS=str(workers))
+    processes = [
+        subprocess.Popen([sys.executable, os.path.basename(script), "--shard", str(shard),
+                          "--num-shards", str(num_shards), "--max-workers", str(workers)] + list(extra_args),
+                         cwd=cwd, env=shard_env)
+        for shard in range(num_shards)
+    ]
+    failed = [shard for shard, process in enumerate(processes) if process.wait() != 0]
+    if failed:
+        print(f"[{stage}] shards {failed} failed; not merging")
+        return 1
+    return subprocess.call([sys.executable, os.path.basename(script), "--merge", "--num-shards", str(num_shards)]
+                           + list(extra_args), cwd=cwd, env=env)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run a sharded stage as local processes and merge the partitions.")
+    parser.add_argument("script", help="Sharded stage script, e.g. Data_Analysis/feature_extraction.py.")
+    parser.add_argument("--num-shards", type=int, required=True)
+    args = parser.parse_args()
+    sys.exit(launch_local(args.script, args.num_shards))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,231 @@
+import os
+import json
+import time
+import wave
+import numpy as np
+import manifest
+import pipeline_config
+from pipeline_metrics import StageMetrics, METRICS_DIR
+from pipeline_executor import SharedExecutor
+
+# Define your main folders
+main_folders = pipeline_config.main_folders()
+config = pipeline_config.config
+
+# Thresholds and analysis settings (see pipeline.json)
+FRAME_MS = config["gate_frame_ms"]
+PROBE_FRAMES = config["gate_probe_frames"]
+SILENCE_DBFS = config["gate_silence_dbfs"]
+MIN_ACTIVE_FRACTION = config["gate_min_active_fraction"]
+MIN_PEAK_DBFS = config["gate_min_peak_dbfs"]
+MAX_CLIPPED_FRACTION = config["gate_max_clipped_fraction"]
+
+# Statistics only depend on these; thresholds are re-applied to cached statistics
+PARAMS = json.dumps({"frame_ms": FRAME_MS, "probe_frames": PROBE_FRAMES, "silence_dbfs": SILENCE_DBFS})
+
+# Stages that process every non-gated file once; their metrics give the per-file cost
+PER_FILE_STAGES = ("features", "plots")
+
+metrics = StageMetrics("gate")
+
+
+def to_dbfs(value):
+    return float(20 * np.log10(max(value, 1e-10)))
+
+
+def decode_frames(raw, sample_width):
+    """PCM bytes to float samples in [-1, 1]."""
+    if sample_width == 1:
+        return (np.frombuffer(raw, dtype=np.uint8).astype(np.float32) - 128) / 128
+    if sample_width == 3:
+        b = np.frombuffer(raw, dtype=np.uint8).reshape(-1, 3).astype(np.int32)
+        ints = b[:, 0] | (b[:, 1] << 8) | (b[:, 2] << 16)
+        return np.where(ints >= 1 << 23, ints - (1 << 24), ints).astype(np.float32) / (1 << 23)
+    dtype = {2: "<i2", 4: "<i4"}[sample_width]
+    return np.frombuffer(raw, dtype=dtype).astype(np.float32) / float(2 ** (8 * sample_width - 1))
+
+
+def frame_statistics(sr, n, read):
+    """
+    Frame-level energy statistics of a file with n frames at sr Hz.
+
+    At most PROBE_FRAMES analysis frames of FRAME_MS are read with
+    read(start, count), spread evenly over the file, so the cost does not
+    grow with clip length.
+    """
+    frame_len = max(1, int(sr * FRAME_MS / 1000))
+    n_frames = n // frame_len
+    if n_frames == 0:
+        return {"duration_s": n / sr if sr else 0.0, "rms_dbfs": None, "peak_dbfs": None,
+                "active_fraction": 0.0, "clipped_fraction": 0.0}
+    starts = np.linspace(0, n_frames - 1, min(n_frames, PROBE_FRAMES)).astype(int) * frame_len
+    rms, peaks, clipped, samples = [], [], 0, 0
+    for start in starts:
+        x = read(int(start), frame_len)
+        a = np.abs(x)
+        rms.append(np.sqrt(np.mean(x * x)))
+        peaks.append(a.max())
+        clipped += int(np.count_nonzero(a >= 0.999))
+        samples += x.size
+    rms = np.asarray(rms)
+    return {
+        "duration_s": n / sr,
+        "rms_dbfs": to_dbfs(np.sqrt(np.mean(rms * rms))),
+        "peak_dbfs": to_dbfs(max(peaks)),
+        "active_fraction": float(np.mean(rms > 10 ** (SILENCE_DBFS / 20))),
+        "clipped_fraction": clipped / samples,
+    }
+
+
+def analyse(path):
+    """
+    Energy statistics from a partial read of a WAV file.
+
+    PCM files are read with the wave module. Float and WAVE_FORMAT_EXTENSIBLE
+    files, which it cannot parse, are read with soundfile (what librosa uses).
+    """
+    try:
+        with wave.open(path, "rb") as w:
+            width = w.getsampwidth()
+
+            def read(start, count):
+                w.setpos(start)
+                return decode_frames(w.readframes(count), width)
+
+            return frame_statistics(w.getframerate(), w.getnframes(), read)
+    except wave.Error:
+        import soundfile
+        with soundfile.SoundFile(path) as f:
+
+            def read(start, count):
+                f.seek(start)
+                return f.read(count, dtype="float32").ravel()
+
+            return frame_statistics(f.samplerate, f.frames, read)
+
+
+def verdict(stats):
+    """'ok', 'unknown' (could not be analysed; not gated), or the reason a clip is gated."""
+    if stats["duration_s"] is None:
+        return "unknown"
+    if stats["rms_dbfs"] is None:
+        return "empty"
+    if stats["active_fraction"] < MIN_ACTIVE_FRACTION:
+        return "silent"
+    if stats["peak_dbfs"] < MIN_PEAK_DBFS:
+        return "quiet"
+    if stats["clipped_fraction"] > MAX_CLIPPED_FRACTION:
+        return "clipped"
+    return "ok"
+
+
+def gate_files_chunk(paths):
+    results = []
+    for path in paths:
+        start = time.perf_counter()
+        try:
+            stats = analyse(path)
+            metrics.item(time.perf_counter() - start)
+        except (wave.Error, EOFError, KeyError, OSError, RuntimeError, ImportError) as e:
+            # Left to the later stages, whose decoders may still read it
+            stats = {"duration_s": None, "rms_dbfs": None, "peak_dbfs": None,
+                     "active_fraction": 0.0, "clipped_fraction": 0.0}
+            metrics.item(time.perf_counter() - start, ok=False)
+            metrics.incr(f"error_{type(e).__name__}")
+        stats["path"] = path
+        results.append(stats)
+    return results, metrics.drain()
+
+
+def mean_latency(stage):
+    """Mean seconds per item of a stage, from its last metrics file (0 if it has not run)."""
+    path = os.path.join(METRICS_DIR, f"{stage}.json")
+    if not os.path.exists(path):
+        return 0.0
+    with open(path) as f:
+        return json.load(f).get("latency_mean_s", 0.0)
+
+
+def extra_augmentations(results, target_count):
+    """
+    Augmented files data_aug writes because of the gate.
+
+    Gated clips do not count towards a directory's target, so every gated
+    clip in a directory below the target is replaced by one more augmentation.
+    """
+    total, gated = {}, {}
+    for stats in results:
+        directory = os.path.dirname(stats["path"])
+        total[directory] = total.get(directory, 0) + 1
+        if is_gated(stats["verdict"]):
+            gated[directory] = gated.get(directory, 0) + 1
+    return sum(min(n, max(0, target_count - (total[directory] - n))) for directory, n in gated.items())
+
+
+def is_gated(verdict):
+    return verdict not in ("ok", "unknown")
+
+
+def main(chunk_size=256):
+    conn = manifest.connect()
+    cached = manifest.gate_results(conn)
+
+    # Only files that are new, changed or analysed with other settings are read; the gate runs
+    # ahead of augmentation, so the copies it makes are left to the next stages
+    paths, hashes, results = [], {}, []
+    for main_folder in main_folders:
+        for root, _, files in os.walk(main_folder):
+            for file in sorted(files):
+                if not file.endswith(".wav") or manifest.AUGMENTED_NAME.match(os.path.splitext(file)[0]):
+                    continue
+                path = os.path.join(root, file)
+                hashes[path] = manifest.cached_file_hash(conn, path)
+                row = cached.get(path)
+                # Files that could not be analysed are retried, the readers may have changed
+                if (row and row["content_hash"] == hashes[path] and row["params"] == PARAMS
+                        and row["duration_s"] is not None):
+                    results.append(dict(row))
+                else:
+                    paths.append(path)
+    metrics.total = len(paths)
+    metrics.counters["cached_files"] = len(results)
+
+    chunks = [paths[i:i + chunk_size] for i in range(0, len(paths), chunk_size)]
+    with SharedExecutor("gate", task_weight=chunk_size) as executor:
+        for chunk_results, snapshot in executor.map_unordered(gate_files_chunk, chunks):
+            for stats in chunk_results:
+                stats.update(content_hash=hashes[stats["path"]], params=PARAMS)
+                results.append(stats)
+            metrics.merge(snapshot)
+            metrics.report()
+
+    # Thresholds are applied to every file, cached or not, so changing them needs no re-read
+    gated_seconds = total_seconds = 0.0
+    for stats in results:
+        stats["verdict"] = verdict(stats)
+        metrics.incr(f"verdict_{stats['verdict']}")
+        total_seconds += stats["duration_s"] or 0.0
+        if is_gated(stats["verdict"]):
+            gated_seconds += stats["duration_s"] or 0.0
+    manifest.record_gate_results(conn, results)
+
+    # Stages that process each file once skip gated files outright
+    gated = sum(1 for stats in results if is_gated(stats["verdict"]))
+    saved_s = gated * sum(mean_latency(stage) for stage in PER_FILE_STAGES)
+    # Augmentation does more work instead: gated clips leave their directories further below target
+    extra = extra_augmentations(results, config["augment_target_count"])
+    extra_s = extra * mean_latency("augment")
+    metrics.counters.update(gated_files=gated, gated_audio_s=round(gated_seconds, 1),
+                            total_audio_s=round(total_seconds, 1), estimated_saved_s=round(saved_s, 1),
+                            extra_augmentations=extra, estimated_extra_augment_s=round(extra_s, 1))
+    metrics.report(force=True)
+    print(f"Gated {gated}/{len(results)} clips ({gated_seconds / 60:.1f} of {total_seconds / 60:.1f} minutes of audio)"
+          + (f", saving about {saved_s / 60:.1f} minutes of {' and '.join(PER_FILE_STAGES)} processing." if saved_s else "."))
+    if extra:
+        print(f"Augmentation writes {extra} more files to reach its target without the gated clips"
+              + (f" (about {extra_s / 60:.1f} more minutes)." if extra_s else "."))
+    metrics.write_json()
+
+
+if __name__ == "__main__":
+    main()
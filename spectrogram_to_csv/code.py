@@ -1,27 +1,39 @@
 import os
-import pandas as pd
+import sys
+
+# The dataset manifest lives at the repository root
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import manifest
+from pipeline_config import config, main_folders
 
 # Directories containing the spectrograms
-emergency_dir = "/mnt/c/Users/jayant-few-shot/Few_shot/new-sounds/emergency-sounds/emergency_spectrograms"
-normal_dir = "/mnt/c/Users/jayant-few-shot/Few_shot/new-sounds/normal-sounds/spectogram_normal_sounds"
+emergency_dir = config["emergency_spectrograms_dir"]
+normal_dir = config["normal_spectrograms_dir"]
 
 # Output CSV file paths
-emergency_csv = "/mnt/c/Users/jayant-few-shot/Few_shot/spectogram_to_csv/emergency_sounds_labels.csv"
-normal_csv = "/mnt/c/Users/jayant-few-shot/Few_shot/spectogram_to_csv/normal_sounds_labels.csv"
-
-def generate_csv(directory, label, output_csv):
-    data = []
-    for file in os.listdir(directory):
-        if file.endswith(".png"):  # Ensure it's a spectrogram image file
-            file_path = os.path.join(directory, file)
-            data.append({"file_path": file_path, "label": label})
-    # Save the data to a CSV file
-    df = pd.DataFrame(data)
-    df.to_csv(output_csv, index=False)
+emergency_csv = config["emergency_labels_csv"]
+normal_csv = config["normal_labels_csv"]
+
+def generate_csv(conn, label, output_csv):
+    # Label files are a query over the manifest rather than a directory listing
+    manifest.export_labels_csv(conn, "spectrogram", output_csv, label=label)
     print(f"CSV file created: {output_csv}")
 
+conn = manifest.connect()
+
+# Register spectrograms not yet in the manifest (only new files are hashed)
+added = manifest.import_directory(conn, emergency_dir, "spectrogram", "emergency sounds", "spectrograms", ".png")
+added += manifest.import_directory(conn, normal_dir, "spectrogram", "normal sounds", "spectrograms", ".png")
+print(f"Registered {added} new spectrograms in the manifest.")
+
+# Link them to the audio clips they were rendered from
+linked, mismatched = manifest.link_spectrograms(conn, main_folders())
+print(f"Linked {linked} spectrograms to their audio clips.")
+for (main_folder, subdirectory), (wav_files, highest) in sorted(mismatched.items()):
+    print(f"Not linked: {main_folder}/{subdirectory} has {wav_files} WAV files but spectrograms up to {highest}.")
+
 # Generate CSV for emergency sounds
-generate_csv(emergency_dir, "emergency", emergency_csv)
+generate_csv(conn, "emergency", emergency_csv)
 
 # Generate CSV for normal sounds
-generate_csv(normal_dir, "normal", normal_csv)
+generate_csv(conn, "normal", normal_csv)
@@ -1,15 +1,23 @@
 import os
 import pandas as pd
 from pydub import AudioSegment
-from multiprocessing import Pool, cpu_count
+import time
+import manifest
+import pipeline_config
+from pipeline_metrics import StageMetrics
+from pipeline_executor import SharedExecutor, decode_cost
 
 # Define your main folders
-main_folders = ['emergency sounds', 'normal sounds']
+main_folders = pipeline_config.main_folders()
+
+metrics = StageMetrics("trim")
 
 # Function to process a single directory's CSV file
 def process_directory(root, file):
     file_count = {}
     wav_files_to_delete = []
+    conn = manifest.connect()
+    main_folder, subdirectory = manifest.split_class_path(root, main_folders)
     
     # Read the CSV file
     csv_path = os.path.join(root, file)
@@ -18,29 +26,44 @@ def process_directory(root, file):
     # Iterate through each row in the CSV file
     for _, row in df.iterrows():
         # Extract the base name before the last underscore in the first column
-        wav_base_name = row[0].rsplit('_', 1)[0]
+        wav_base_name = row.iloc[0].rsplit('_', 1)[0]
         try:
-            start_time = float(row[1]) * 1000  # Convert seconds to milliseconds
-            end_time = float(row[2]) * 1000    # Convert seconds to milliseconds
+            start_time = float(row.iloc[1]) * 1000  # Convert seconds to milliseconds
+            end_time = float(row.iloc[2]) * 1000    # Convert seconds to milliseconds
         except ValueError:
-            print("Error: One of the values in row[1] or row[2] is not a valid number.")
+            # Start or end time is not a number
+            metrics.incr("invalid_window")
             continue
         
         # Check if the trimmed version already exists
         file_count[wav_base_name] = file_count.get(wav_base_name, 0) + 1
         unique_suffix = file_count[wav_base_name]
         output_path = os.path.join(root, f"{wav_base_name}_{unique_suffix}.wav")
+
+        # Register the segment window in the manifest, linked to the downloaded clip
+        segment_id = row.iloc[0].strip()
+        parent_id = manifest.add_clip(conn, main_folder, subdirectory, segment_id=segment_id)
+        clip_id = manifest.add_clip(conn, main_folder, subdirectory, segment_id=segment_id,
+                                    segment_index=unique_suffix, start_ms=int(start_time), end_ms=int(end_time),
+                                    parent_id=parent_id)
         
         # If the trimmed audio file already exists, skip trimming this audio
+        if manifest.stage_file(conn, clip_id, "trimmed"):
+            metrics.incr("already_trimmed")
+            continue
         if os.path.exists(output_path):
-            print(f"Trimmed file already exists: {output_path}. Skipping this file.")
+            # Trimmed before the manifest existed; record it instead of trimming again
+            manifest.record_file(conn, clip_id, "trimmed", output_path)
+            metrics.incr("already_trimmed")
             continue
         
-        # Construct the .wav file path
-        wav_file_path = os.path.join(root, f"{wav_base_name}.wav")
+        # Construct the .wav file path (recorded by the downloader, or the conventional name)
+        wav_file_path = manifest.stage_file(conn, parent_id, "download") or os.path.join(root, f"{wav_base_name}.wav")
         
         # Check if the .wav file exists
         if os.path.exists(wav_file_path):
+            start = time.perf_counter()
+
             # Load the audio file
             audio = AudioSegment.from_wav(wav_file_path)
             
@@ -49,22 +72,33 @@ def process_directory(root, file):
             
             # Export the trimmed audio
             trimmed_audio.export(output_path, format="wav")
-            print(f"Trimmed audio saved: {output_path}")
+            manifest.record_file(conn, clip_id, "trimmed", output_path)
+            metrics.item(time.perf_counter() - start)
             
             # Add the original wav file path to the list for deletion later
             if wav_file_path not in wav_files_to_delete:
                 wav_files_to_delete.append(wav_file_path)
         else:
-            print(f"Wav file not found: {wav_file_path}")
+            metrics.incr("source_missing")
     
-    # Return the list of files to delete
-    return wav_files_to_delete
+    # Return the list of files to delete and this worker's metrics
+    return wav_files_to_delete, metrics.drain()
+
+def process_directory_task(task):
+    return process_directory(*task)
+
+# A task loads one source WAV at a time; its peak memory is set by the largest one in the directory
+def directory_cost(task):
+    root = task[0]
+    return decode_cost(*[os.path.join(root, f) for f in os.listdir(root) if f.endswith('.wav')])
 
 # Function to delete wav files after processing all directories
 def delete_wav_files(wav_files_to_delete):
+    conn = manifest.connect()
     for wav_file in wav_files_to_delete:
         os.remove(wav_file)
-        print(f"Deleted original audio file: {wav_file}")
+        manifest.remove_file(conn, wav_file)
+    print(f"Deleted {len(wav_files_to_delete)} original audio files.")
 
 # Main function to handle parallel processing
 def parallel_process():
@@ -76,13 +110,22 @@ def parallel_process():
                 if file.endswith('.csv'):
                     tasks.append((root, file))
     
-    # Use multiprocessing to process CSV files in parallel
-    with Pool(processes=75) as pool:
-        results = pool.starmap(process_directory, tasks)
+    # Use multiprocessing to process CSV files in parallel, aggregating progress as CSVs finish
+    all_wav_files_to_delete = []
+    # A task works through a whole directory, so workers are recycled by the WAVs it holds
+    wav_files = [sum(1 for f in os.listdir(root) if f.endswith('.wav')) for root, _ in tasks]
+    task_weight = max(1, sum(wav_files) / len(wav_files)) if wav_files else 1
+    with SharedExecutor("trim", task_weight=task_weight) as executor:
+        for wav_files_to_delete, snapshot in executor.map_unordered(process_directory_task, tasks, cost=directory_cost):
+            all_wav_files_to_delete.extend(wav_files_to_delete)
+            metrics.merge(snapshot)
+            metrics.incr("csv_files")
+            metrics.report()
+    metrics.report(force=True)
     
-    # Flatten the list of results and delete original wav files
-    all_wav_files_to_delete = [item for sublist in results for item in sublist]
+    # Delete original wav files
     delete_wav_files(all_wav_files_to_delete)
+    metrics.write_json()
 
 if __name__ == "__main__":
     parallel_process()
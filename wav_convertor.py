@@ -0,0 +1,332 @@
+import os
+import re
+import sys
+import json
+import time
+import shutil
+import tempfile
+import argparse
+import threading
+import subprocess
+import pandas as pd
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import pipeline_config
+from pipeline_executor import available_cpus
+
+# Canonical format every clip is normalised to
+CANONICAL_CODEC = "pcm_s16le"
+CANONICAL_SAMPLE_RATE = 44100
+CANONICAL_CHANNELS = 1
+
+# Containers the downloader can leave behind
+AUDIO_EXTENSIONS = ('.wav', '.m4a', '.webm', '.mp3', '.ogg', '.opus')
+
+# Length of the segment the downloader cuts from each video, starting at the segment_id offset
+SEGMENT_SECONDS = 10.0
+
+# Define your main folders
+main_folders = pipeline_config.main_folders()
+
+# Default number of concurrent ffmpeg processes (each runs single-threaded)
+default_workers = available_cpus()
+
+
+def probe(path):
+    """Codec, sample rate and channel count of the first audio stream (via ffprobe)."""
+    result = subprocess.run(
+        ["ffprobe", "-v", "error", "-select_streams", "a:0", "-show_entries",
+         "stream=codec_name,sample_rate,channels:format=duration", "-of", "json", path],
+        capture_output=True, text=True, check=True,
+    )
+    info = json.loads(result.stdout)
+    stream = info["streams"][0]
+    return {
+        "codec": stream["codec_name"],
+        "sample_rate": int(stream["sample_rate"]),
+        "channels": int(stream["channels"]),
+        "duration": float(info.get("format", {}).get("duration", 0.0)),
+    }
+
+
+def is_canonical(path, info):
+    return (path.endswith(".wav") and info["codec"] == CANONICAL_CODEC
+            and info["sample_rate"] == CANONICAL_SAMPLE_RATE and info["channels"] == CANONICAL_CHANNELS)
+
+
+def build_command(input_path, segments, stream_copy):
+    """
+    One ffmpeg invocation writing every segment of an input.
+
+    Args:
+    - input_path: Source audio file.
+    - segments: List of (start_s, end_s, output_path); start/end of None means the whole file.
+    - stream_copy: Copy the PCM stream instead of re-encoding (input already canonical).
+
+    The input is seeked once to the earliest segment start (fast input seeking),
+    and every output then seeks relative to that point.
+    """
+    starts = [s for s, _, _ in segments if s is not None]
+    seek = min(starts) if starts and len(starts) == len(segments) else 0.0
+    command = ["ffmpeg", "-hide_banner", "-nostdin", "-loglevel", "error", "-y", "-threads", "1"]
+    if seek > 0:
+        command += ["-ss", f"{seek:.3f}"]
+    command += ["-i", input_path]
+
+    if stream_copy:
+        codec_args = ["-c:a", "copy"]
+    else:
+        codec_args = ["-c:a", CANONICAL_CODEC, "-ar", str(CANONICAL_SAMPLE_RATE), "-ac", str(CANONICAL_CHANNELS)]
+
+    for start, end, output_path in segments:
+        command += ["-map", "0:a:0", "-vn"]
+        if start is not None:
+            command += ["-ss", f"{start - seek:.3f}", "-t", f"{end - start:.3f}"]
+        command += codec_args + ["-f", "wav", output_path + ".part"]
+    return command
+
+
+class ProgressJournal:
+    """
+    Append-only JSON-lines record of finished outputs, so an interrupted run
+    can be restarted and skips everything already converted.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.done = set()
+        if os.path.exists(path):
+            with open(path) as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        continue  # Truncated last line from an interrupted run
+                    if entry.get("status") == "ok":
+                        self.done.add(entry["output"])
+
+    def is_done(self, output_path):
+        return output_path in self.done and os.path.exists(output_path)
+
+    def record(self, input_path, output_path, status, seconds, error=None):
+        entry = {"input": input_path, "output": output_path, "status": status, "seconds": round(seconds, 3)}
+        if error:
+            entry["error"] = error
+        with self.lock:
+            with open(self.path, "a") as f:
+                f.write(json.dumps(entry) + "\n")
+            if status == "ok":
+                self.done.add(output_path)
+
+
+def run_job(input_path, segments, journal, delete_source=False):
+    """
+    Transcode/trim one input into all of its pending segments.
+
+    Outputs are written to '<name>.part' and renamed when ffmpeg succeeds, so
+    a killed run never leaves a truncated .wav behind.
+    Returns the list of outputs written.
+    """
+    pending = [seg for seg in segments if not journal.is_done(seg[2])]
+    if not pending:
+        return []
+
+    start = time.perf_counter()
+    try:
+        info = probe(input_path)
+        stream_copy = is_canonical(input_path, info)
+        # Whole-file copies of canonical files are no-ops
+        if stream_copy and len(pending) == 1 and pending[0][0] is None and pending[0][2] == input_path:
+            journal.record(input_path, input_path, "ok", 0.0)
+            return []
+        subprocess.run(build_command(input_path, pending, stream_copy), capture_output=True, text=True, check=True)
+    except (subprocess.CalledProcessError, OSError, KeyError, IndexError, ValueError) as e:
+        error = e.stderr.strip() if isinstance(e, subprocess.CalledProcessError) else str(e)
+        for _, _, output_path in pending:
+            if os.path.exists(output_path + ".part"):
+                os.remove(output_path + ".part")
+            journal.record(input_path, output_path, "error", time.perf_counter() - start, error)
+        print(f"Error converting {input_path}: {error}")
+        return []
+
+    elapsed = time.perf_counter() - start
+    for _, _, output_path in pending:
+        os.replace(output_path + ".part", output_path)
+        journal.record(input_path, output_path, "ok", elapsed / len(pending))
+
+    if delete_source and input_path not in [output_path for _, _, output_path in pending]:
+        os.remove(input_path)
+    return [output_path for _, _, output_path in pending]
+
+
+def parse_segment_id(segment_id):
+    """Source id and segment offset in seconds of an AudioSet style '<youtube id>_<offset ms>'."""
+    source_id, offset_ms = segment_id.strip().rsplit('_', 1)
+    return source_id, int(offset_ms) / 1000.0
+
+
+def segment_offsets(root):
+    """{source id: segment offset in seconds} from the segment CSVs of a class directory."""
+    offsets = {}
+    for file in sorted(os.listdir(root)):
+        if not file.endswith(".csv"):
+            continue
+        for segment_id in pd.read_csv(os.path.join(root, file)).iloc[:, 0]:
+            try:
+                source_id, offset = parse_segment_id(str(segment_id))
+            except ValueError:
+                continue
+            # The downloader names files by video id, so only the first segment of a video is kept
+            offsets.setdefault(source_id, offset)
+    return offsets
+
+
+def conversion_jobs(folders):
+    """
+    Jobs normalising every non-.wav audio file under the folders to canonical WAV.
+
+    These files are full-length downloads, so the job cuts the segment the
+    downloader would have kept ([offset, offset + SEGMENT_SECONDS]).
+    """
+    jobs = []
+    for folder in folders:
+        for root, _, files in os.walk(folder):
+            offsets = None
+            for file in files:
+                base, ext = os.path.splitext(file)
+                if ext not in AUDIO_EXTENSIONS or ext == ".wav":
+                    continue
+                if offsets is None:
+                    offsets = segment_offsets(root)
+                if base not in offsets:
+                    print(f"No segment offset for {os.path.join(root, file)}; not converted")
+                    continue
+                start = offsets[base]
+                jobs.append((os.path.join(root, file),
+                             [(start, start + SEGMENT_SECONDS, os.path.join(root, base + ".wav"))]))
+    return jobs
+
+
+def run_jobs(jobs, progress_path, max_workers=default_workers, delete_source=False):
+    """
+    Run jobs on a bounded pool of concurrent ffmpeg processes.
+
+    Args:
+    - jobs: List of (input_path, segments) from conversion_jobs.
+    - progress_path: JSON-lines journal used to resume interrupted runs.
+    - max_workers: Maximum number of ffmpeg processes at once.
+    - delete_source: Remove each input once all of its outputs are written.
+
+    Returns (outputs written, jobs failed).
+    """
+    journal = ProgressJournal(progress_path)
+    written = failed = 0
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {executor.submit(run_job, input_path, segments, journal, delete_source): (input_path, segments)
+                   for input_path, segments in jobs}
+        for i, future in enumerate(as_completed(futures), start=1):
+            input_path, segments = futures[future]
+            outputs = future.result()
+            written += len(outputs)
+            if not all(journal.is_done(output_path) for _, _, output_path in segments):
+                failed += 1
+            if i % 100 == 0 or i == len(futures):
+                print(f"{i}/{len(futures)} inputs processed, {written} outputs written, {failed} failed")
+    return written, failed
+
+
+def generate_test_media(directory, download_duration=30, offset=12):
+    """
+    Create local test media in the class-folder layout, plus a segment CSV.
+
+    The .m4a (sine) and .webm (noise) files stand in for full-length downloads
+    the downloader could not cut: they last download_duration seconds and are
+    silent except for the segment [offset, offset + SEGMENT_SECONDS].
+    """
+    class_dir = os.path.join(directory, "emergency sounds", "Siren")
+    os.makedirs(class_dir, exist_ok=True)
+    segment = f"between(t,{offset},{offset + SEGMENT_SECONDS})"
+    sources = {
+        "sine0000001.m4a": ["-f", "lavfi", "-i", f"aevalsrc='if({segment},0.5*sin(2*PI*880*t),0)':s=44100:d={download_duration}",
+                            "-c:a", "aac"],
+        "noise000001.webm": ["-f", "lavfi", "-i", f"aevalsrc='if({segment},0.5*(2*random(0)-1),0)':s=48000:d={download_duration}",
+                             "-c:a", "libopus"],
+    }
+    rows = []
+    for name, args in sources.items():
+        subprocess.run(["ffmpeg", "-hide_banner", "-loglevel", "error", "-y"] + args + [os.path.join(class_dir, name)],
+                       check=True)
+        segment_id = f"{os.path.splitext(name)[0]}_{offset * 1000}"
+        rows += [(segment_id, 0.5, 2.5, "Siren"), (segment_id, 4.0, 9.0, "Siren")]
+    pd.DataFrame(rows, columns=["segment_id", "start_time_seconds", "end_time_seconds", "label"]).to_csv(
+        os.path.join(class_dir, "segments.csv"), index=False)
+    return os.path.join(directory, "emergency sounds")
+
+
+def mean_volume(path):
+    """Mean volume of a file in dBFS (via ffmpeg's volumedetect filter)."""
+    result = subprocess.run(["ffmpeg", "-hide_banner", "-nostdin", "-i", path, "-af", "volumedetect", "-f", "null", "-"],
+                            capture_output=True, text=True, check=True)
+    return float(re.search(r"mean_volume: (\S+) dB", result.stderr).group(1))
+
+
+def self_test():
+    """
+    Convert locally generated media and check every output is canonical,
+    lasts one segment and comes from inside the downloaded segment.
+    """
+    directory = tempfile.mkdtemp(prefix="wav_convertor_")
+    try:
+        folder = generate_test_media(directory)
+        progress = os.path.join(directory, "progress.jsonl")
+        converted, failed = run_jobs(conversion_jobs([folder]), progress)
+        # A second run must find everything done
+        rerun, _ = run_jobs(conversion_jobs([folder]), progress)
+
+        problems = []
+        for file in ["sine0000001.wav", "noise000001.wav"]:
+            path = os.path.join(folder, "Siren", file)
+            info = probe(path)
+            if not is_canonical(path, info):
+                problems.append(f"{file} is not canonical")
+            if abs(info["duration"] - SEGMENT_SECONDS) > 0.05:
+                problems.append(f"{file} lasts {info['duration']:.3f}s, expected {SEGMENT_SECONDS}s")
+            # Audio outside the segment is silent, so a segment cut from the wrong place is too
+            if mean_volume(path) < -40:
+                problems.append(f"{file} is silent: cut from outside the downloaded segment")
+
+        print(f"Converted {converted}, re-run wrote {rerun}, failed {failed}")
+        if problems or failed or rerun or converted != 2:
+            print("Self-test FAILED:", problems)
+            return 1
+        print("Self-test passed.")
+        return 0
+    finally:
+        shutil.rmtree(directory)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Batch transcode downloaded audio to canonical WAV with ffmpeg.")
+    parser.add_argument("command", choices=["convert", "selftest"],
+                        help="convert: normalise downloaded files; selftest: run on generated media")
+    parser.add_argument("folders", nargs="*", default=main_folders)
+    parser.add_argument("--workers", type=int, default=default_workers, help="Concurrent ffmpeg processes.")
+    parser.add_argument("--progress", default="convert_progress.jsonl", help="Journal used to resume interrupted runs.")
+    parser.add_argument("--delete-source", action="store_true", help="Delete inputs once all their outputs exist.")
+    args = parser.parse_args()
+
+    if shutil.which("ffmpeg") is None or shutil.which("ffprobe") is None:
+        print("ffmpeg is not installed. Please install ffmpeg first.")
+        sys.exit(1)
+
+    if args.command == "selftest":
+        sys.exit(self_test())
+
+    jobs = conversion_jobs(args.folders)
+    written, failed = run_jobs(jobs, args.progress, args.workers, args.delete_source)
+
+    print(f"Finished: {len(jobs)} inputs, {written} outputs written, {failed} inputs with errors.")
+
+
+if __name__ == "__main__":
+    main()